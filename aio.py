@@ -0,0 +1,124 @@
+"""
+An asyncio runtime that runs every device as a coroutine on one event loop
+instead of a thread per device.
+"""
+
+import asyncio
+from typing import List
+from frame import view_frame
+from wire import HEARTBEAT, taken
+import logs
+
+class Runtime():
+    """
+    Represents an event loop driving the sim, with an asyncio queue as the
+    inbox of each device.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.queues = dict()
+        self.running = 0 # Nodes that still have messages to get out
+        self.done = None
+        self.jobs = list()
+
+    @property
+    def now(self) -> float:
+        return self.loop.time()
+
+    def inbox(self, d: object) -> asyncio.Queue:
+        """
+        Gets the inbox of a device.
+        """
+
+        if (d not in self.queues):
+            self.queues[d] = asyncio.Queue()
+        return self.queues[d]
+
+    def deliver(self, link: object, msg: bytes, delay: float = None) -> None:
+        """
+        Puts a frame in the inbox of the device on the read end of a wire,
+        once it has had the time it takes to cross.
+        """
+
+        if (delay):
+            self.loop.call_later(delay, self.inbox(link.read).put_nowait,
+                                 (link, msg))
+        else:
+            self.inbox(link.read).put_nowait((link, msg))
+
+    def heartbeat(self, d: object) -> None:
+        """
+        Wakes a device up to run its timers, and sets the next wake up.
+        """
+
+        self.inbox(d).put_nowait((None, None))
+        self.loop.call_later(HEARTBEAT, self.heartbeat, d)
+
+    def wake(self, d: object) -> None:
+        """
+        Runs what a device has due on the clock, and sets the next wake up.
+        """
+
+        d.wake()
+        t = d.next_wake()
+        if (t is not None):
+            self.loop.call_later(max(t - self.now, 0), self.wake, d)
+
+    async def job_loop(self, d: object) -> None:
+        """
+        Pulls frames out of the inbox of a device and processes them.
+        """
+
+        q = self.inbox(d)
+        self.loop.call_later(HEARTBEAT, self.heartbeat, d)
+        self.wake(d)
+        pull = (d.name >= 0)
+
+        while (1):
+            (w, msg) = await q.get()
+            if (w is None):
+                d.processes_frame(None, None)
+            else:
+                taken(w)
+                d.processes_frame(w, view_frame(msg))
+
+            # If we are done with out work, tell the sim.
+
+            if (not d.alive) and pull:
+                pull = False
+                self.running -= 1
+                logs.log(logs.INFO, d, "#- {}", self.running)
+                if (self.running == 0):
+                    self.done.set()
+
+    async def main(self, devices: List[object]) -> None:
+        """
+        Runs every device until all the nodes are done.
+        """
+
+        self.done = asyncio.Event()
+        self.running = len([x for x in devices if (x.name >= 0)])
+        for x in devices:
+            self.spawn(x)
+        await self.done.wait()
+        for x in self.jobs:
+            x.cancel()
+        await asyncio.gather(*self.jobs, return_exceptions=True)
+
+    def spawn(self, d: object) -> None:
+        """
+        Starts running a device, such as one joining while the sim runs.
+        """
+
+        self.jobs.append(self.loop.create_task(self.job_loop(d)))
+
+    def run(self, devices: List[object]) -> None:
+        """
+        Runs the sim on the event loop.
+        """
+
+        try:
+            self.loop.run_until_complete(self.main(devices))
+        finally:
+            self.loop.close()
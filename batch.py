@@ -0,0 +1,140 @@
+"""
+Used to encode, decode and check frames in bulk as NumPy structured arrays.
+Needs numpy, which the rest of the sim does not.
+"""
+
+import numpy as np
+from typing import Iterable, List, Sequence, Union
+from frame import Frame, dump_header, view_frame
+from wire import WRITE_LINKS, deliver
+import node
+
+DATA_SIZE = 255 # Most bytes of data a frame in a batch can hold
+
+HEADER_FIELDS = ["dn", "dst", "sn", "src", "crc", "size", "ack"]
+WIDE_FIELDS = ["dn", "dst", "sn", "src", "size"] # 16 bits in a v1 header
+
+FRAME_DTYPE = np.dtype([*[(x, "u2" if (x in WIDE_FIELDS) else "u1")
+                          for x in HEADER_FIELDS],
+                        ("len", "u2"),
+                        ("data", "u1", (DATA_SIZE,))])
+
+def empty_batch(n: int) -> np.ndarray:
+    """
+    Makes a batch of n blank frames.
+    """
+
+    return np.zeros(n, dtype=FRAME_DTYPE)
+
+def _put_data(a: np.ndarray, i: int, b: bytes) -> None:
+    if (len(b) > DATA_SIZE):
+        raise Exception("Frame data too large for batch!")
+    a["len"][i] = len(b)
+    a["data"][i, :len(b)] = np.frombuffer(b, dtype=np.uint8)
+
+def pack_frames(frames: Iterable[Frame]) -> np.ndarray:
+    """
+    Packs frames into a batch.
+    """
+
+    frames = list(frames)
+    a = empty_batch(len(frames))
+    for (i, f) in enumerate(frames):
+        for x in HEADER_FIELDS:
+            a[x][i] = getattr(f, x)
+        _put_data(a, i, f.data.encode("utf-8"))
+    return a
+
+def unpack_frames(a: np.ndarray) -> List[Frame]:
+    """
+    Unpacks a batch back into frames.
+    """
+
+    hdr = np.stack([a[x] for x in HEADER_FIELDS], axis=1).tolist()
+    return [Frame(*h, a["data"][i, :a["len"][i]].tobytes().decode("utf-8"))
+            for (i, h) in enumerate(hdr)]
+
+def encode_frames(a: np.ndarray) -> List[bytes]:
+    """
+    Dumps every frame in a batch as bytes for the wire.
+    """
+
+    # Each frame gets the smallest header version its fields fit in
+
+    hdr = np.stack([a[x] for x in HEADER_FIELDS], axis=1).tolist()
+    return [dump_header(*h) + a["data"][i, :a["len"][i]].tobytes()
+            for (i, h) in enumerate(hdr)]
+
+def decode_frames(raws: Sequence[bytes]) -> np.ndarray:
+    """
+    Loads frames dumped as bytes, such as ones captured off a wire, into a
+    batch.
+    """
+
+    a = empty_batch(len(raws))
+    hdr = np.zeros((len(raws), len(HEADER_FIELDS)), dtype=np.uint16)
+    for (i, x) in enumerate(raws):
+        v = view_frame(x)
+        hdr[i] = v.hdr
+        _put_data(a, i, x[v.off:])
+    for (i, x) in enumerate(HEADER_FIELDS):
+        a[x] = hdr[:, i]
+    return a
+
+def batch_crc(a: np.ndarray) -> np.ndarray:
+    """
+    Calulates the crc of every frame in a batch.
+    """
+
+    # CRC is just the sum of all bytes truncated to the last byte, and the
+    # padding after the data is all zeros.
+
+    tmp = a["data"].sum(axis=1, dtype=np.uint32)
+    for x in WIDE_FIELDS:
+        tmp += (a[x] >> 8) + (a[x] & 0xFF)
+    tmp += a["ack"]
+    return (tmp & 0xFF).astype(np.uint8)
+
+def batch_valid(a: np.ndarray) -> np.ndarray:
+    """
+    Checks the crc of every frame in a batch.
+    """
+
+    return batch_crc(a) == a["crc"]
+
+def make_frames(dn: Union[int, Sequence[int]], dst: Union[int, Sequence[int]],
+                sn: Union[int, Sequence[int]], src: Union[int, Sequence[int]],
+                ack: Union[int, Sequence[int]],
+                data: Sequence[str]) -> np.ndarray:
+    """
+    Make a batch of frames the easy way. Header values can be one value for
+    every frame or one per frame.
+    """
+
+    a = empty_batch(len(data))
+    a["dn"] = dn
+    a["dst"] = dst
+    a["sn"] = sn
+    a["src"] = src
+    a["ack"] = ack
+    a["size"] = [len(x) for x in data]
+    for (i, x) in enumerate(data):
+        _put_data(a, i, x.encode("utf-8"))
+    a["crc"] = batch_crc(a)
+    return a
+
+def inject(d: object, a: np.ndarray) -> None:
+    """
+    Sends out a batch of frames from a node, tracking them for ACKs the same
+    way Node.init_msg does. Not with a window, as the frames in a batch have
+    no sequence numbers.
+    """
+
+    if (node.WINDOW is not None):
+        raise Exception("Batches can not be injected with a window, send"
+                        " them with Node.send_msg instead!")
+
+    for msg in encode_frames(a):
+        d.track(view_frame(msg))
+        for link in WRITE_LINKS[d]:
+            deliver(link, msg)
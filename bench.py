@@ -0,0 +1,248 @@
+"""
+Used to time the sim at a range of sizes without touching the disk, so we
+can tell if a change to a hot path is a speed up or a regression.
+
+    python bench.py --save baseline.json
+    python bench.py --baseline baseline.json
+
+Each run is done in its own process, so the globals the sim keeps (links,
+inboxes, the engine) start clean and peak memory is just that run's.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import sys
+import threading
+from queue import Empty
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Tuple
+
+# Sizes to run at by default: nodes, networks, messages per node
+
+SCALES = [(8, 2, 8), (32, 4, 8), (64, 8, 16)]
+MODES = ["engine", "thread"]
+TOLERANCE = 0.1 # How much worse (as a fraction) than the baseline is allowed
+SAMPLE_TIME = 0.01 # How often (sec) to count threads while running
+SEED = 0 # Seed for the random errors, so each run sees the same ones
+
+def make_messages(ids: List[Tuple[int, int]],
+                  per_node: int) -> Dict[str, List[Tuple[int, int, str]]]:
+    """
+    Makes the messages for each node, given as (net, name), spread over
+    every other node, in the form Main takes them.
+    """
+
+    num_nodes = len(ids)
+    ret = dict()
+    for (i, (net, name)) in enumerate(ids):
+        tmp = list()
+        for k in range(per_node):
+            (dn, dst) = ids[(i + 1 + (k % (num_nodes - 1))) % num_nodes]
+            tmp.append((dn, dst, f"{k} from {net}_{name}"))
+        ret[f"{net}_{name}"] = tmp
+    return ret
+
+def run_one(mode: str, num_nodes: int, num_net: int, per_node: int,
+            errors: bool, shape: str, static: bool, out: object) -> None:
+    """
+    Runs the sim once and puts what was measured on out.
+    """
+
+    import device
+    import main
+    import node
+    import switch
+    import topology
+    import wire
+    import writer
+    import logs
+
+    # Keep everything in memory and say nothing
+
+    node.ERR = errors
+    switch.ERR = errors
+    device.SEED = SEED
+    logs.setup(logs.QUIET)
+    writer.use(writer.MemorySink())
+    layout = topology.SHAPES[shape](num_nodes, num_net)
+    msgs = make_messages([(layout.switches[k], x) for (x, k) in layout.nodes],
+                         per_node)
+
+    # Count threads on the side while running
+
+    peak = [threading.active_count()]
+    running = [True]
+
+    def sample():
+        while (running[0]):
+            peak[0] = max(peak[0], threading.active_count())
+            sleep(SAMPLE_TIME)
+
+    threading.Thread(target=sample, daemon=True).start()
+    t = perf_counter()
+    main.Main(num_nodes, num_net, mode, rules=list(), messages=msgs,
+              layout=None if (shape == "star") else layout, static=static)
+    t = perf_counter() - t
+
+    # A run faster than SAMPLE_TIME may not have been sampled at all, the
+    # device threads are still winding down so count them now
+
+    peak[0] = max(peak[0], threading.active_count())
+    running[0] = False
+
+    # Frames sent in other processes are not counted here
+
+    frames = None
+    if (mode != "shard"):
+        frames = sum(wire.SENT.snapshot().values())
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    out.put({"frames": frames,
+             "frames_per_sec": None if (frames is None) else frames / t,
+             "quiesce_sec": t,
+             "peak_rss_mb": rss / 1024,
+             "peak_threads": peak[0]})
+
+def measure(mode: str, num_nodes: int, num_net: int, per_node: int,
+            errors: bool = False, repeat: int = 1,
+            shape: str = "star", static: bool = False) -> Dict[str, object]:
+    """
+    Runs the sim repeat times in fresh processes, keeping the fastest run.
+    """
+
+    ctx = mp.get_context("spawn")
+    best = None
+    for x in range(repeat):
+        q = ctx.Queue()
+        p = ctx.Process(target=run_one,
+                        args=(mode, num_nodes, num_net, per_node, errors,
+                              shape, static, q))
+        p.start()
+
+        # Dont wait forever on a run that blew up
+
+        while (1):
+            try:
+                tmp = q.get(timeout=1)
+                break
+            except Empty:
+                if (not p.is_alive()):
+                    raise Exception(f"Run {mode} {num_nodes}x{num_net}"
+                                    f"x{per_node} failed!")
+        p.join()
+        if ((best is None) or (tmp["quiesce_sec"] < best["quiesce_sec"])):
+            best = tmp
+    return best
+
+def key(mode: str, num_nodes: int, num_net: int, per_node: int,
+        shape: str = "star", static: bool = False) -> str:
+    if (shape != "star"):
+        mode = f"{mode} {shape}"
+    if (static):
+        mode = f"{mode} static"
+    return f"{mode} {num_nodes}x{num_net}x{per_node}"
+
+def compare(new: Dict[str, object], old: Dict[str, object],
+            tolerance: float = TOLERANCE) -> Optional[str]:
+    """
+    Checks one result against its baseline, giving back what got worse.
+    """
+
+    if ((new["frames_per_sec"] is not None)
+        and (old.get("frames_per_sec") is not None)
+        and (new["frames_per_sec"] < old["frames_per_sec"] * (1 - tolerance))):
+        return "frames/sec"
+    if (new["quiesce_sec"] > old["quiesce_sec"] * (1 + tolerance)):
+        return "time to quiesce"
+    if ((old.get("peak_rss_mb") is not None)
+        and (new["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance))):
+        return "peak RSS"
+    return None
+
+def _speedup(old: Optional[float], new: Optional[float]) -> str:
+    if ((old is None) or (not new)):
+        return "-"
+    return f"{old / new:.2f}x"
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the sim at a range of sizes.')
+    parser.add_argument('--mode', action='append', default=None,
+                        choices=['thread', 'engine', 'async', 'shard'],
+                        help='Mode to run in, can be given more than once.')
+    parser.add_argument('--scale', action='append', default=None,
+                        help=('Size to run at as NODESxNETWORKSxMESSAGES,'
+                              ' can be given more than once.'))
+    parser.add_argument('--topology', default='star',
+                        choices=['star', 'tree', 'ring', 'mesh'],
+                        help=('Layout to build, with NETWORKS switches (or'
+                              ' that many below each switch of a tree).'))
+    parser.add_argument('--static', action='store_true',
+                        help=('Give switches static routes instead of'
+                              ' learning them, not in shard mode.'))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs of each size to keep the fastest of.')
+    parser.add_argument('--errors', action='store_true',
+                        help='Keep the random drops and bad crcs turned on.')
+    parser.add_argument('--baseline', default=None,
+                        help='Compare against the results in this file.')
+    parser.add_argument('--save', default=None,
+                        help='Write the results to this file.')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='How much worse than the baseline is allowed.')
+    args = parser.parse_args(argv)
+
+    modes = args.mode or MODES
+    if (args.static and ("shard" in modes)):
+        if (args.mode):
+            parser.error("Shard mode can not use static routes.")
+        modes = [x for x in modes if (x != "shard")]
+    scales = SCALES
+    if (args.scale):
+        scales = [tuple(int(i) for i in x.split("x")) for x in args.scale]
+    old = dict()
+    if (args.baseline):
+        with open(args.baseline) as f:
+            old = json.load(f)
+
+    # Run every size in every mode
+
+    results = dict()
+    worse = list()
+    print(f"{'RUN':<28}{'FRAMES/SEC':>12}{'QUIESCE':>10}{'RSS MB':>9}"
+          f"{'THREADS':>9}{'VS BASE':>9}")
+    for m in modes:
+        for (n, k, p) in scales:
+            name = key(m, n, k, p, args.topology, args.static)
+            tmp = measure(m, n, k, p, args.errors, args.repeat,
+                          args.topology, args.static)
+            results[name] = tmp
+            fps = tmp["frames_per_sec"]
+            line = (f"{name:<28}"
+                    f"{'-' if (fps is None) else f'{fps:.0f}':>12}"
+                    f"{tmp['quiesce_sec']:>9.3f}s"
+                    f"{tmp['peak_rss_mb']:>9.1f}"
+                    f"{tmp['peak_threads']:>9}")
+            if (name in old):
+                speed = _speedup(old[name]["quiesce_sec"], tmp["quiesce_sec"])
+                line += f"{speed:>9}"
+                bad = compare(tmp, old[name], args.tolerance)
+                if (bad is not None):
+                    worse.append((name, bad))
+                    line += f"  WORSE {bad}"
+            print(line, flush=True)
+
+    if (args.save):
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+
+    # Fail if anything got worse, so this can gate a change
+
+    for (name, bad) in worse:
+        print(f"!! {name} REGRESSED IN {bad}")
+    return 1 if worse else 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Used to record every frame put on a wire to a binary trace, and to read
+traces back to replay them or look through them offline.
+
+A trace starts with MAGIC, then has one record per frame: the time it was
+put on the wire, the wire it was put on and the bytes of the frame. The
+first time a wire is seen a record with NEW as its wire gives its label,
+after that the wire is known by the order it was first seen in.
+
+    python capture.py trace.bin         sums up a trace
+    python capture.py trace.bin --dump  prints every frame in it
+"""
+
+import argparse
+import mmap
+from collections import Counter
+from struct import Struct
+from threading import Lock
+from time import sleep
+from typing import Dict, Iterator, Tuple
+from frame import FrameView, get_type, view_frame
+import engine
+import wire
+
+MAGIC = b"HAMCAP\x00\x02"
+RECORD = Struct("<dII") # time, wire, size of the bytes after
+NEW = 0xFFFFFFFF # Marks a record naming the next wire
+
+class Capture():
+    """
+    Represents a trace being written. Hand it to wire.TAP to record every
+    frame sent.
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.ids = dict() # wire label -> id
+        self.lock = Lock()
+
+    def record(self, link: wire.Wire, msg: bytes) -> None:
+        """
+        Adds a frame put on a wire to the trace.
+        """
+
+        t = engine.now()
+        with self.lock:
+            i = self.ids.get(link.label, None)
+            if (i is None):
+                i = len(self.ids)
+                self.ids[link.label] = i
+                b = link.label.encode("utf-8")
+                self.f.write(RECORD.pack(t, NEW, len(b)) + b)
+            self.f.write(RECORD.pack(t, i, len(msg)) + msg)
+
+    def close(self) -> None:
+        with self.lock:
+            self.f.close()
+
+class Trace():
+    """
+    Represents a trace being read, mapped into memory rather than read in.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if (self.map[:len(MAGIC)] != MAGIC):
+            raise Exception("Not a frame trace!")
+
+    def __iter__(self) -> Iterator[Tuple[float, str, bytes]]:
+        """
+        Goes through the frames as (time, wire label, bytes).
+        """
+
+        m = self.map
+        i = len(MAGIC)
+        links = list()
+        while (i < len(m)):
+            (t, w, n) = RECORD.unpack_from(m, i)
+            i += RECORD.size
+            b = m[i:i+n]
+            i += n
+            if (w == NEW):
+                links.append(b.decode("utf-8"))
+                continue
+            yield (t, links[w], b)
+
+    def frames(self) -> Iterator[Tuple[float, str, FrameView]]:
+        """
+        Goes through the frames as (time, wire label, frame).
+        """
+
+        for (t, w, b) in self:
+            yield (t, w, view_frame(b))
+
+    def summary(self) -> Dict[str, object]:
+        """
+        Counts the frames and bytes on each wire, and the frames of each type.
+        """
+
+        frames = Counter()
+        size = Counter()
+        types = Counter()
+        (start, end) = (None, None)
+        for (t, w, f) in self.frames():
+            if (start is None):
+                start = t
+            end = t
+            frames[w] += 1
+            size[w] += len(f.raw)
+            types[get_type(f).name] += 1
+        return {"frames": sum(frames.values()), "bytes": sum(size.values()),
+                "time": 0 if (start is None) else end - start,
+                "types": dict(types), "wire_frames": dict(frames),
+                "wire_bytes": dict(size)}
+
+    def close(self) -> None:
+        self.map.close()
+
+def replay(path: str, links: Dict[str, wire.Wire] = None) -> None:
+    """
+    Puts every frame in a trace back on its wire, as far apart as they were
+    recorded. With the engine driving the sim they are scheduled on its
+    clock, otherwise this waits out the gaps.
+
+    :arg links: Wires to use by label, by default every connected wire.
+    """
+
+    if (links is None):
+        links = {x.label: x for x in wire.LINKS.values()}
+    tmp = Trace(path)
+    start = None
+    offset = engine.now()
+    for (t, w, b) in tmp:
+        if (start is None):
+            start = t
+        if (w not in links):
+            raise Exception(f"Wire {w} in trace is not connected!")
+        due = offset + (t - start)
+        if (engine.ENGINE is not None):
+            engine.ENGINE.schedule(max(due - engine.now(), 0), wire.deliver,
+                                   links[w], b)
+        else:
+            if (due > engine.now()):
+                sleep(due - engine.now())
+            wire.deliver(links[w], b)
+    tmp.close()
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description='Looks through a trace.')
+    parser.add_argument('path', help='Trace to read.')
+    parser.add_argument('--dump', action='store_true',
+                        help='Print every frame.')
+    args = parser.parse_args()
+    trace = Trace(args.path)
+    if (args.dump):
+        for (t, w, f) in trace.frames():
+            print(f"{t:.6f} {w} {f}")
+    else:
+        s = trace.summary()
+        print(f"{s['frames']} FRAMES, {s['bytes']} BYTES OVER {s['time']:.3f}"
+              " SEC")
+        for (k, v) in sorted(s["types"].items()):
+            print(f"  {k}: {v}")
+        for (k, v) in sorted(s["wire_frames"].items()):
+            print(f"  {k}: {v} FRAMES, {s['wire_bytes'][k]} BYTES")
+    trace.close()
@@ -0,0 +1,92 @@
+"""
+Used to remember which frames a node has already recorded, in bounded
+memory.
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from typing import Hashable, Tuple
+from engine import now
+
+WINDOW = 1024 # How many frames from each sender are remembered exactly
+MAX_AGE = 60 # How long (sec) a frame is remembered exactly
+BLOOM = False # Remember frames past the window in a bloom filter
+BLOOM_BITS = 1 << 20 # Size of the bloom filter
+BLOOM_HASHES = 4 # Number of bits set for each frame in the bloom filter
+
+class Bloom():
+    """
+    Represents a bloom filter. It can say a frame was seen when it was not,
+    but never the other way around.
+    """
+
+    def __init__(self, bits: int = BLOOM_BITS, hashes: int = BLOOM_HASHES):
+        self.size = bits
+        self.hashes = hashes
+        self.bits = bytearray(bits // 8)
+
+    def _spots(self, key: Hashable):
+        tmp = blake2b(repr(key).encode("utf-8"),
+                      digest_size=4 * self.hashes).digest()
+        for x in range(self.hashes):
+            yield int.from_bytes(tmp[x*4:(x+1)*4], "big") % self.size
+
+    def add(self, key: Hashable) -> None:
+        for x in self._spots(key):
+            self.bits[x >> 3] |= 1 << (x & 7)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return all(self.bits[x >> 3] & (1 << (x & 7))
+                   for x in self._spots(key))
+
+class Seen():
+    """
+    Represents the frames a node has recorded, as a sliding window of the
+    latest ones from each sender. Frames that slide out are forgotten, or
+    kept in a bloom filter if asked for.
+
+    Keys are (sn, src, dn, dst, data), the first two picking the sender.
+    """
+
+    def __init__(self, window: int = WINDOW, max_age: float = MAX_AGE,
+                 bloom: bool = BLOOM):
+        self.window = window
+        self.max_age = max_age
+        self.windows = dict() # (sn, src) -> OrderedDict(key -> time seen)
+        self.bloom = Bloom() if bloom else None
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.windows.values())
+
+    def _trim(self, w: OrderedDict) -> None:
+        """
+        Slides the oldest frames out of a sender's window.
+        """
+
+        t = now() - self.max_age
+        while (w and ((len(w) > self.window) or (next(iter(w.values())) < t))):
+            (k, _) = w.popitem(last=False)
+            if (self.bloom is not None):
+                self.bloom.add(k)
+
+    def add(self, key: Tuple) -> None:
+        """
+        Remembers a frame.
+        """
+
+        with self.lock:
+            w = self.windows.setdefault(key[:2], OrderedDict())
+            w[key] = now()
+            w.move_to_end(key)
+            self._trim(w)
+
+    def __contains__(self, key: Tuple) -> bool:
+        with self.lock:
+            w = self.windows.get(key[:2], None)
+            if (w is not None):
+                self._trim(w)
+                if (key in w):
+                    return True
+            return (self.bloom is not None) and (key in self.bloom)
@@ -3,13 +3,19 @@ Represents a the bone work for a entity on the network that is conected to
 wires.
 """
 
-from time import sleep
-from tops import GLOBAL_RUN
-from wire import Wire, receive
+from random import Random
+from threading import Lock
+from time import time
+import tops
+import logs
+from wire import Wire, receive, HEARTBEAT
 from dataclasses import dataclass, field
 from frame import Frame
-from threading import Thread
-from typing import List
+from pool import Pool, WORKERS
+from typing import List, Optional
+
+SEED = None # Seed for the random numbers of every device, None for any run
+LEAVE_LOCK = Lock() # Makes sure each device only leaves once
 
 @dataclass(unsafe_hash=True)
 class Device():
@@ -19,6 +25,26 @@ class Device():
     name: int
     net: int
     alive: bool = field(default=True, hash=False, compare=False)
+    pool: Pool = field(default=None, hash=False, compare=False)
+    workers: int = field(default=WORKERS, hash=False, compare=False)
+
+    def __post_init__(self):
+        # Labels name the device in metrics and traces, so unlike the repr
+        # they tell apart switches on the same network
+
+        if (self.name < 0):
+            self.label = f"{self.net}_SWITCH{-self.name}"
+        else:
+            self.label = f"{self}"
+        self.joined = False # Counted as running in tops.RUN
+
+        # Each device gets its own random numbers, seeded by who it is so the
+        # same run comes out the same whatever order devices are made in
+
+        if (SEED is None):
+            self.rng = Random()
+        else:
+            self.rng = Random(f"{SEED}:{self.net}:{self.name}")
 
     def __repr__(self) -> str:
         if (self.name < 0):
@@ -34,44 +60,95 @@ class Device():
         """
         ...
 
+    def wake(self) -> None:
+        """
+        Does anything that is due on the clock, other than heart beats.
+        """
+        ...
+
+    def next_wake(self) -> Optional[float]:
+        """
+        Gets when wake next has something to do, None if nothing.
+        """
+
+        return None
+
+    def join(self) -> None:
+        """
+        Counts the device as running, so the sim waits for it to be done.
+        """
+
+        self.joined = True
+        logs.log(logs.INFO, self, "#+ {}", tops.RUN.join())
+
+    def leave(self) -> None:
+        """
+        Stops counting the device as running, once.
+        """
+
+        with LEAVE_LOCK:
+            if (not self.joined):
+                return
+            self.joined = False
+        logs.log(logs.INFO, self, "#- {}", tops.RUN.leave())
+
+    def handle(self, w: Wire, f: Frame) -> None:
+        """
+        Processes a frame for job_loop, then tells the sim if that was the
+        end of our work and that the frame is gone.
+        """
+
+        try:
+            self.processes_frame(w, f)
+        finally:
+            if (not self.alive):
+                self.leave()
+            if (w is not None):
+                tops.RUN.landed()
+
     def job_loop(self) -> None:
         """
         Pulls Messages from the connected wires and processes them with
         diffrent threads.
         """
 
-        # Add our job to the global wait queue to make sure we dont close while
-        # others are wating to send us packets. (if we are a node)
-
-        if (self.name >= 0):
-            GLOBAL_RUN.put(f"{self.name}")
-            print(f"#+ {GLOBAL_RUN.qsize()}")
-
-        # While the sim is running, execte the folowing
+        # Use our own pool of workers unless we were given a shared one
 
-        pull = True
-        jobs = []
-        while (self.alive or GLOBAL_RUN.qsize()):
+        own = self.pool is None
+        if (own):
+            self.pool = Pool(str(self), self.workers)
 
-            # See if we have any frames sent to us
+        # Keep going until every node is done and no frames are left, even
+        # once we are done ourselves others may still send us frames
 
-            (w, f) = receive(self)
+        beat = time() + HEARTBEAT
+        while (not tops.RUN.done.is_set()):
 
-            # Send the frame to a sub thred to be proccesed
+            # See if we have any frames sent to us, and if it is time for a
+            # heart beat run one with empty values.
 
-            tmp = Thread(target=self.processes_frame, name=f"[{self}-{f}]",
-                         args=(w, f))
+            self.wake()
+            wait = beat - time()
+            if (wait <= 0):
+                (w, f) = (None, None)
+                beat = time() + HEARTBEAT
+            else:
 
-            # Track said thread
+                # Dont sleep past the next thing due, and if that is what
+                # woke us go back around to do it
 
-            jobs.append(tmp)
-            tmp.start()
+                t = self.next_wake()
+                if (t is not None):
+                    wait = max(min(wait, t - time()), 0)
+                (w, f) = receive(self, wait)
+                if ((w is None) and (time() < beat)):
+                    continue
 
-            # If we are done with out work, tell the sim.
+            # Send the frame to a worker thread to be proccesed
 
-            if (not self.alive) and pull:
-                pull = False
-                GLOBAL_RUN.get()
-                print(f"#- {GLOBAL_RUN.qsize()}")
+            self.pool.submit(self.handle, w, f)
 
-        print(f"!! EXITING {self}")
+        if (own):
+            self.pool.shutdown()
+            self.pool = None
+        logs.log(logs.INFO, self, "!! EXITING {}", self)
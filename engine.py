@@ -0,0 +1,123 @@
+"""
+A discrete event engine for running the sim on a virtual clock instead of
+a thread per device.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+from typing import Callable
+
+LINK_DELAY = 0.001 # How long (virtual sec) a frame spends on a wire
+HEARTBEAT = 0.5 # How often (virtual sec) a node checks its timers
+
+ENGINE = None # What is driving the sim, None when running with threads
+
+def now() -> float:
+    """
+    Gets the current time of the sim from whatever is driving it.
+    """
+
+    if (ENGINE is None):
+        return time()
+    return ENGINE.now
+
+class Engine():
+    """
+    Represents a heap ordered queue of events on a simulated clock.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = list()
+        self.order = count() # Keep events at the same time in FIFO order
+        self.live = 0 # Events that are not just timers
+        self.processed = 0
+
+    def schedule(self, delay: float, fn: Callable, *args,
+                 timer: bool = False) -> None:
+        """
+        Schedules fn(*args) to run delay seconds from now.
+
+        :arg timer: The event is a periodic timer and does not keep the sim
+                    alive on its own.
+        """
+
+        heappush(self.events, (self.now + delay, next(self.order), timer, fn,
+                               args))
+        if (not timer):
+            self.live += 1
+
+    def deliver(self, link: object, msg: bytes, delay: float = None) -> None:
+        """
+        Delivers a frame to the device on the read end of a wire after the
+        time it takes to cross, by default the link delay.
+        """
+
+        if (delay is None):
+            delay = LINK_DELAY
+        self.schedule(delay, self.arrive, link, msg)
+
+    def arrive(self, link: object, msg: bytes) -> None:
+        """
+        Hands a frame that is done crossing a wire to its device.
+        """
+
+        # Import here as the frame spec and wires have no need to know about
+        # us
+
+        from frame import view_frame
+        from wire import taken
+        taken(link)
+        link.read.processes_frame(link, view_frame(msg))
+
+    def heartbeat(self, d: object) -> None:
+        """
+        Runs the timers of a device for as long as it is alive.
+        """
+
+        d.processes_frame(None, None)
+        if (d.alive):
+            self.schedule(HEARTBEAT, self.heartbeat, d, timer=True)
+
+    def start(self, d: object) -> None:
+        """
+        Starts the timers for a device.
+        """
+
+        self.schedule(HEARTBEAT, self.heartbeat, d, timer=True)
+        self.wake(d)
+
+    def wake(self, d: object) -> None:
+        """
+        Runs what a device has due on the clock, and sets the next wake up.
+        """
+
+        d.wake()
+        t = d.next_wake()
+        if (t is not None):
+            self.schedule(max(t - self.now, 0), self.wake, d)
+
+    def run(self, done: Callable[[], bool]) -> None:
+        """
+        Runs events in time order until nothing is in flight and done()
+        says the sim is finished.
+        """
+
+        while (self.events):
+            if ((self.live == 0) and done()):
+                break
+            (t, _, timer, fn, args) = heappop(self.events)
+            if (not timer):
+                self.live -= 1
+            self.now = t
+            self.processed += 1
+            fn(*args)
+
+def use(e: Engine) -> None:
+    """
+    Makes the given engine or event loop (or threads if None) drive the sim.
+    """
+
+    global ENGINE
+    ENGINE = e
@@ -0,0 +1,231 @@
+"""
+Used to compile firewall rules into tables that can be checked in constant
+time.
+
+Rules are written as NET_NODE, the same as in firewall.txt:
+
+    2_#       block every frame to network 2 (global)
+    2-4_#     block every frame to networks 2 through 4 (global)
+    1_3       block every frame to node 3 (local)
+    1_3-7     block every frame to nodes 3 through 7 (local)
+    1_2>3_4   block frames from node 1_2 to node 3_4, either side can use #
+              for a whole network (global)
+
+Global rules are checked by the central switch, local ones are sent out to
+the branch switches as RULE frames. A RULE frame starting with ! removes the
+rule after it.
+"""
+
+import os
+from re import match
+from typing import List, Optional, Set, Tuple
+from engine import now
+from frame import Frame
+
+RULES = "firewall.txt" # Where the rules are read from by default
+ID_SPACE = 1 << 16 # Largest id a frame can carry, plus one
+RELOAD_TIME = 2 # How often (sec) to check the rules file for changes
+REMOVE = "!" # Marks a RULE frame as taking a rule away
+
+def _span(x: str) -> Tuple[int, int]:
+    """
+    Parses an id or a range of ids.
+    """
+
+    if ("-" in x):
+        (lo, hi) = x.split("-")
+        return (int(lo), int(hi))
+    return (int(x), int(x))
+
+def _end(x: str) -> Tuple[int, Optional[int]]:
+    """
+    Parses one side of a pair rule.
+    """
+
+    (net, node) = x.split("_")
+    if (node == "#"):
+        return (int(net), None)
+    return (int(net), int(node))
+
+def parse(rule: str) -> Tuple:
+    """
+    Parses a rule into its kind and ids.
+    """
+
+    rule = rule.strip()
+    if (">" in rule):
+        (a, b) = rule.split(">")
+        return ("pair", *_end(a), *_end(b))
+    if ("_" not in rule):
+        return ("node", *_span(rule))
+    (net, node) = rule.split("_")
+    if (node == "#"):
+        return ("net", *_span(net))
+    return ("node", *_span(node))
+
+def is_global(rule: str) -> bool:
+    """
+    Checks if a rule is enforced by the central switch rather than sent out
+    to the branches.
+    """
+
+    return parse(rule)[0] != "node"
+
+def load(path: str) -> List[str]:
+    """
+    Reads the rules out of a firewall file.
+    """
+
+    ret = list()
+    with open(path) as f:
+        for l in f.readlines():
+            if (not l.strip()):
+                continue
+            m = match(r'(.*):.*', l)
+            if (m is None):
+                raise Exception("Malformed firewall file!")
+            ret.append(m[1].strip())
+    return ret
+
+def split(rules: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Splits rules into the global and local ones.
+    """
+
+    g = [x for x in rules if is_global(x)]
+    l = [x for x in rules if not is_global(x)]
+    return (g, l)
+
+class Firewall():
+    """
+    Represents a set of rules compiled into bitmaps of blocked networks and
+    nodes, and a set of blocked pairs.
+    """
+
+    def __init__(self, rules: List[str] = list(), path: str = None):
+        self.rules = set()
+        self.nets = bytearray(ID_SPACE)
+        self.nodes = bytearray(ID_SPACE)
+        self.pairs = frozenset()
+        self.path = path
+        self.mirror = None # Firewall of a standby switch to copy changes to
+        self.mtime = self.stat()
+        self.checked = now()
+        self.replace(rules)
+
+    def __repr__(self) -> str:
+        return f"{sorted(self.rules)}"
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def compile(self) -> None:
+        """
+        Rebuilds the lookup tables from the rules.
+        """
+
+        nets = bytearray(ID_SPACE)
+        nodes = bytearray(ID_SPACE)
+        pairs = set()
+        for x in self.rules:
+            tmp = parse(x)
+            if (tmp[0] == "net"):
+                nets[tmp[1]:tmp[2]+1] = b"\x01" * (tmp[2] - tmp[1] + 1)
+            elif (tmp[0] == "node"):
+                nodes[tmp[1]:tmp[2]+1] = b"\x01" * (tmp[2] - tmp[1] + 1)
+            else:
+                pairs.add(tmp[1:])
+
+        # Swap the tables in all at once so readers never see half of them
+
+        (self.nets, self.nodes, self.pairs) = (nets, nodes, frozenset(pairs))
+
+    def add(self, rule: str) -> bool:
+        """
+        Adds a rule, or takes one away if it starts with REMOVE, giving back
+        if anything changed.
+        """
+
+        if (self.mirror is not None):
+            self.mirror.add(rule)
+
+        # Taking a rule away might uncover another, so rebuild everything
+
+        if (rule.startswith(REMOVE)):
+            tmp = rule[len(REMOVE):].strip()
+            if (tmp not in self.rules):
+                return False
+            self.rules.discard(tmp)
+            self.compile()
+            return True
+
+        # Adding one can just be marked in place
+
+        tmp = parse(rule)
+        if (rule.strip() in self.rules):
+            return False
+        self.rules.add(rule.strip())
+        if (tmp[0] == "net"):
+            self.nets[tmp[1]:tmp[2]+1] = b"\x01" * (tmp[2] - tmp[1] + 1)
+        elif (tmp[0] == "node"):
+            self.nodes[tmp[1]:tmp[2]+1] = b"\x01" * (tmp[2] - tmp[1] + 1)
+        else:
+            self.pairs = self.pairs | {tmp[1:]}
+        return True
+
+    def replace(self, rules: List[str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Swaps in a new set of rules, giving back the ones added and removed.
+        """
+
+        new = {x.strip() for x in rules}
+        for x in new:
+            parse(x)
+        if (self.mirror is not None):
+            self.mirror.replace(new)
+        added = new - self.rules
+        removed = self.rules - new
+        self.rules = new
+        self.compile()
+        return (added, removed)
+
+    def blocks(self, f: Frame) -> bool:
+        """
+        Checks if a frame is blocked by any rule.
+        """
+
+        if (self.nets[f.dn] or self.nodes[f.dst]):
+            return True
+        p = self.pairs
+        if (not p):
+            return False
+        return (((f.sn, f.src, f.dn, f.dst) in p)
+                or ((f.sn, None, f.dn, f.dst) in p)
+                or ((f.sn, f.src, f.dn, None) in p)
+                or ((f.sn, None, f.dn, None) in p))
+
+    def stat(self) -> Optional[float]:
+        """
+        Gets when the rules file was last changed.
+        """
+
+        if (self.path is None):
+            return None
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def changed(self) -> bool:
+        """
+        Checks (at most every RELOAD_TIME) if the rules file has changed.
+        """
+
+        if ((self.path is None) or ((self.checked + RELOAD_TIME) > now())):
+            return False
+        self.checked = now()
+        mtime = self.stat()
+        if (mtime == self.mtime):
+            return False
+        self.mtime = mtime
+        return True
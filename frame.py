@@ -4,6 +4,8 @@ Used to manipulate the frame spec we use.
 
 from dataclasses import dataclass, field
 from enum import Enum, auto
+from struct import Struct
+from typing import Iterable, List, Tuple
 
 # Macros for easy ACK asignment
 
@@ -11,8 +13,27 @@ RCKv = 0b00000000
 NAKv = 0b00000001
 FAKv = 0b00000010
 ACKv = 0b00000011
+SACKv = 0b00000100
 RULEv = 0b00000111
 
+# Flags a MSG can have in its ack, as it is not used for anything else
+
+SEQv = 0b00001000 # Data starts with a sequence number, see split_seq
+PUSHv = 0b00010000 # Sender wants a SACK for it right away
+
+# Layout of the original header: dn, dst, sn, src, crc, size, ack
+
+HEADER = Struct(">7B")
+
+# Frames that need ids or sizes past 255 start with EXT and a version byte
+# instead. Version 1 is the same header with 16 bit ids and size. This means
+# a network of 255 can not be used with the original header.
+
+EXT = 0xFF
+V0 = 0
+V1 = 1
+HEADER_V1 = Struct(">BBHHHHBHB")
+
 class FType(Enum):
     """
     Represents the difrent configurations of frames that will be seen.
@@ -22,6 +43,7 @@ class FType(Enum):
     NAK = auto() # Recieved but bad CRC.
     FAK = auto() # MSG hit firewall.
     RCK = auto() # Resend ACK.
+    SACK = auto() # Verification of many sequenced msgs at once.
     RULE = auto() # Firewall rule.
 
 @dataclass(eq=True)
@@ -47,12 +69,76 @@ class Frame():
                f" {self.crc} ({is_valid(self)})")
         return ret
 
+class FrameView():
+    """
+    Represents a frame read straight out of its bytes. Header fields are read
+    from the buffer when asked for and the data is only decoded once used.
+    """
+
+    __slots__ = ("raw", "buf", "hdr", "off", "_data", "_crc")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.buf = memoryview(raw)
+        if (self.buf[0] == EXT):
+            if (self.buf[1] != V1):
+                raise Exception("Unknown frame version!")
+            self.hdr = HEADER_V1.unpack_from(self.buf)[2:]
+            self.off = HEADER_V1.size
+        else:
+            self.hdr = HEADER.unpack_from(self.buf)
+            self.off = HEADER.size
+        self._data = None
+        self._crc = None
+
+    dn = property(lambda self: self.hdr[0])
+    dst = property(lambda self: self.hdr[1])
+    sn = property(lambda self: self.hdr[2])
+    src = property(lambda self: self.hdr[3])
+    crc = property(lambda self: self.hdr[4])
+    size = property(lambda self: self.hdr[5])
+    ack = property(lambda self: self.hdr[6])
+
+    @property
+    def version(self) -> int:
+        if (self.off == HEADER.size):
+            return V0
+        return self.buf[1]
+
+    @property
+    def data(self) -> str:
+        if (self._data is None):
+            self._data = str(self.buf[self.off:], "utf-8")
+        return self._data
+
+    __repr__ = Frame.__repr__
+
+def dump_header(dn: int, dst: int, sn: int, src: int, crc: int, size: int,
+                ack: int, version: int = None) -> bytes:
+    """
+    Dumps the header of a frame as bytes.
+
+    :arg version: Header version to use, by default the original one unless
+                  a field does not fit in it.
+    """
+
+    if (version is None):
+        if ((max(dn, dst, sn, src, size) > 0xFF) or (dn == EXT)):
+            version = V1
+        else:
+            version = V0
+
+    if (version == V0):
+        return HEADER.pack(dn, dst, sn, src, crc, size, ack)
+    return HEADER_V1.pack(EXT, version, dn, dst, sn, src, crc, size, ack)
+
 def dump_frame(f:Frame, force_crc = 0x00,
-               do_crc: bool = True) -> bytes:
+               do_crc: bool = True, version: int = None) -> bytes:
     """
     Dumps a frame as bytes.
 
     :arg do_crc: Calulate crc.
+    :arg version: Header version to use, see dump_header.
     """
 
     # To calulate the crc we need to dump with an empyt crc first.
@@ -62,15 +148,15 @@ def dump_frame(f:Frame, force_crc = 0x00,
     else:
         crc = force_crc
 
+    # A frame we read off a wire can go back out as the same bytes
+
+    if ((type(f) is FrameView) and (crc == f.crc)
+        and (version in (None, f.version))):
+        return f.raw
+
     # Dump object as A BINARY FORMAT AS REQUESTED
 
-    tmp = f.dn.to_bytes(1, "big")
-    tmp += f.dst.to_bytes(1, "big")
-    tmp += f.sn.to_bytes(1, "big")
-    tmp += f.src.to_bytes(1, "big")
-    tmp += crc.to_bytes(1, "big")
-    tmp += f.size.to_bytes(1, "big")
-    tmp += f.ack.to_bytes(1, "big")
+    tmp = dump_header(f.dn, f.dst, f.sn, f.src, crc, f.size, f.ack, version)
     tmp += f.data.encode("utf-8")
 
     return tmp
@@ -82,25 +168,57 @@ def load_frame(b:bytes) -> Frame:
 
     # Load object as A BINARY FORMAT AS REQUESTED
 
-    tmp = Frame(int(b[0]),
-                int(b[1]),
-                int(b[2]),
-                int(b[3]),
-                int(b[4]),
-                int(b[5]),
-                int(b[6]),
-                b[7:].decode("utf-8"))
+    if (b[0] == EXT):
+        v = view_frame(b)
+        return Frame(*v.hdr, v.data)
+    tmp = Frame(*HEADER.unpack_from(b), b[HEADER.size:].decode("utf-8"))
     return tmp
 
+def view_frame(b: bytes) -> FrameView:
+    """
+    Views a frame as bytes without copying or decoding it.
+    """
+
+    return FrameView(b)
+
+def _byte_sum(x: int) -> int:
+    return (x >> 8) + (x & 0xFF)
+
 def calc_crc(f:Frame) -> int:
     """
     Calulates the crc of the frame.
     """
 
-    # CRC is just the sum of all bytes truncated to the last byte
+    # Frames keep their crc around with the fields it was worked out from,
+    # so it is only used again if none of them have changed since. Views
+    # cant change so they just keep the crc.
+
+    if (type(f) is FrameView):
+        if (f._crc is not None):
+            return f._crc
+    else:
+        key = (f.dn, f.dst, f.sn, f.src, f.size, f.ack, f.data)
+        tmp = f.__dict__.get("_crc", None)
+        if ((tmp is not None) and (tmp[0] == key)):
+            return tmp[1]
+
+    # CRC is just the sum of all bytes truncated to the last byte, which we
+    # can get from the fields without dumping the frame. The bytes of the
+    # version marker are left out so it comes out the same in any version.
 
-    tmp = dump_frame(f, do_crc=False)
-    l = sum(tmp).to_bytes(500, "big")[-1]
+    if (type(f) is FrameView):
+        l = sum(f.buf) - f.crc
+        if (f.version != V0):
+            l -= EXT + f.version
+        l &= 0xFF
+    else:
+        l = (_byte_sum(f.dn) + _byte_sum(f.dst) + _byte_sum(f.sn)
+             + _byte_sum(f.src) + _byte_sum(f.size) + f.ack
+             + sum(f.data.encode("utf-8"))) & 0xFF
+    if (type(f) is FrameView):
+        f._crc = l
+    else:
+        f._crc = (key, l)
     return l
 
 
@@ -126,6 +244,8 @@ def get_type(f:Frame) -> FType:
             return FType.FAK
         elif (f.ack == ACKv):
             return FType.ACK
+        elif (f.ack == SACKv):
+            return FType.SACK
         elif (f.ack == RULEv):
             return FType.RULE
     else:
@@ -136,8 +256,7 @@ def make_frame(dn: int, dst: int, sn: int,
     """
     Make a frame the easy way.
     """
-    tmp = Frame(dn, dst, sn, src, 0x00, 0x00, ack, data)
-    tmp.size = len(data)
+    tmp = Frame(dn, dst, sn, src, 0x00, len(data), ack, data)
     tmp.crc = calc_crc(tmp)
     return tmp
 
@@ -149,3 +268,39 @@ def make_ack(dn: int, dst: int, sn: int,
     tmp = Frame(dn, dst, sn, src, 0x00, 0x00, ack, data)
     tmp.crc = calc_crc(tmp)
     return tmp
+
+def split_seq(data: str) -> Tuple[int, str]:
+    """
+    Splits the data of a sequenced MSG into its sequence number and the
+    message itself.
+    """
+
+    (seq, _, data) = data.partition("|")
+    return (int(seq), data)
+
+def dump_sack(cum: int, got: Iterable[int]) -> str:
+    """
+    Dumps what a SACK says was recieved: every sequence number before cum,
+    and the ones in got past it as ranges, ie 4;6-8,10-10.
+    """
+
+    ranges = list()
+    for x in sorted(got):
+        if (ranges and (ranges[-1][1] == x - 1)):
+            ranges[-1][1] = x
+        else:
+            ranges.append([x, x])
+    return f"{cum};" + ",".join(f"{a}-{b}" for (a, b) in ranges)
+
+def load_sack(data: str) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Loads what a SACK says was recieved as cum and a list of ranges.
+    """
+
+    (cum, _, tmp) = data.partition(";")
+    ranges = list()
+    for x in tmp.split(","):
+        if (x):
+            (a, _, b) = x.partition("-")
+            ranges.append((int(a), int(b)))
+    return (int(cum), ranges)
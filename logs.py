@@ -0,0 +1,176 @@
+"""
+Used to log what the devices are doing. Lines are only formatted once we
+know they will be kept, so a quiet run pays next to nothing for them.
+"""
+
+import sys
+from collections import deque
+from struct import Struct
+from threading import Lock
+from time import time
+from typing import Iterator, Optional, Set, Tuple
+
+# Levels, lowest to highest
+
+DEBUG = 10 # What happens to every frame
+INFO = 20 # Setup, rule changes, devices coming and going
+WARN = 30 # Things going wrong
+QUIET = 100 # Nothing at all
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warn": WARN, "quiet": QUIET}
+BAR = "-" * 40 # Splits up the logs of each frame
+
+class Stdout():
+    """
+    Represents a sink printing records, one whole record at a time.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+
+    def emit(self, level: int, dev: str, text: str) -> None:
+        with self.lock:
+            sys.stdout.write(text + "\n")
+
+    def close(self) -> None:
+        sys.stdout.flush()
+
+class Ring():
+    """
+    Represents a sink keeping the latest records in memory.
+    """
+
+    def __init__(self, size: int = 10000):
+        self.records = deque(maxlen=size)
+
+    def emit(self, level: int, dev: str, text: str) -> None:
+        self.records.append((time(), level, dev, text))
+
+    def close(self) -> None:
+        ...
+
+# Layout of each record in a binary log: time, level, size of the device
+# name, size of the text
+
+RECORD = Struct("<dBBI")
+
+class Binary():
+    """
+    Represents a sink appending records to a binary file.
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, "ab")
+        self.lock = Lock()
+
+    def emit(self, level: int, dev: str, text: str) -> None:
+        d = dev.encode("utf-8")
+        t = text.encode("utf-8")
+        with self.lock:
+            self.f.write(RECORD.pack(time(), level, len(d), len(t)) + d + t)
+
+    def close(self) -> None:
+        with self.lock:
+            self.f.close()
+
+def read_binary(path: str) -> Iterator[Tuple[float, int, str, str]]:
+    """
+    Reads the records back out of a binary log.
+    """
+
+    with open(path, "rb") as f:
+        b = f.read()
+    i = 0
+    while (i < len(b)):
+        (t, level, dn, tn) = RECORD.unpack_from(b, i)
+        i += RECORD.size
+        dev = b[i:i+dn].decode("utf-8")
+        text = b[i+dn:i+dn+tn].decode("utf-8")
+        i += dn + tn
+        yield (t, level, dev, text)
+
+LEVEL = DEBUG # Lowest level that is kept
+DEVICES = None # Names of the only devices to keep logs of, None for all
+SINK = Stdout() # Where kept records go
+
+def setup(level: int = None, devices: Optional[Set[str]] = None,
+          sink: object = None) -> None:
+    """
+    Sets what gets logged and where it goes.
+    """
+
+    global LEVEL, DEVICES, SINK
+    if (level is not None):
+        LEVEL = level
+    DEVICES = devices
+    if (sink is not None):
+        SINK.close()
+        SINK = sink
+
+def enabled(level: int, dev: object = None) -> bool:
+    """
+    Checks if a record would be kept.
+    """
+
+    if (level < LEVEL):
+        return False
+    return (DEVICES is None) or (dev is None) or (f"{dev}" in DEVICES)
+
+class Record():
+    """
+    Represents the lines logged while handling one frame. Each line is a
+    format string and its arguments, only put together on flush.
+    """
+
+    __slots__ = ("level", "dev", "lines")
+
+    def __init__(self, level: int, dev: object):
+        self.level = level
+        self.dev = dev
+        self.lines = list()
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def append(self, fmt: str, *args) -> None:
+        self.lines.append((fmt, args))
+
+    def flush(self) -> None:
+        text = "\n".join(x.format(*a) if a else x for (x, a) in self.lines)
+        SINK.emit(self.level, f"{self.dev}", text)
+
+class Null():
+    """
+    Represents a record that will not be kept, it does nothing.
+    """
+
+    __slots__ = ()
+
+    def __len__(self) -> int:
+        return 0
+
+    def append(self, fmt: str, *args) -> None:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+NULL = Null()
+
+def start(level: int, dev: object) -> object:
+    """
+    Starts a record for a device, or a stand in if it would not be kept.
+    """
+
+    if (enabled(level, dev)):
+        return Record(level, dev)
+    return NULL
+
+def log(level: int, dev: object, fmt: str, *args) -> None:
+    """
+    Logs one line.
+    """
+
+    if (enabled(level, dev)):
+        SINK.emit(level, "" if (dev is None) else f"{dev}",
+                  fmt.format(*args) if args else fmt)
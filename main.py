@@ -2,18 +2,31 @@
 The Main file for running the program.
 """
 
-from copy import deepcopy
-from time import sleep
-from tops import GLOBAL_RUN
+import tops
 from dataclasses import dataclass, field
-from itertools import cycle
-from threading import Thread
-from typing import List, Tuple
-from re import match
+from threading import Thread, Timer
+from time import time
+from typing import Dict, List, Tuple
 import argparse
 from node import Node
 from switch import Switch
-from wire import connect, LINKS
+from wire import LINKS, rewire
+from pool import Pool, WORKERS
+from aio import Runtime
+import shard
+import firewall
+from firewall import RULES
+import writer
+import logs
+import engine
+import metrics
+import topology
+import traffic
+import capture
+import device
+import node
+import wire
+from functools import partial
 
 DEV = False # This will generate the nessary .txt files if you dont have your
             # own
@@ -27,55 +40,89 @@ class Main():
     cas: List[Switch]
     css: Switch
     shadow: Switch
-    global_blocks: List[int] = field(default_factory=list)
-    local_blocks: List[int] = field(default_factory=list)
+    global_blocks: List[str] = field(default_factory=list)
+    local_blocks: List[str] = field(default_factory=list)
+
+    def __init__(self, num_nodes: int, num_net: int,
+                 mode: str = "thread", workers: int = WORKERS,
+                 shared_pool: bool = False, rules: List[str] = None,
+                 messages: Dict[str, List[Tuple[int, int, str]]] = None,
+                 layout: topology.Topology = None,
+                 traffic: traffic.Pattern = None,
+                 failover: float = None, static: bool = False) -> None:
+        """
+        Builds the network and runs it until every node is done.
+
+        :arg rules: Firewall rules to use, by default read from the rules file
+                    and reloaded when it changes.
+        :arg messages: Messages each node sends as (net, node, data) keyed by
+                       node id (ie 1_0), by default read from the node files.
+        :arg layout: Switches and nodes to build, by default a central switch
+                     with a branch switch for each network.
+        :arg traffic: Pattern nodes send messages in as they go, instead of
+                      all at the start.
+        :arg failover: Time (sec) into the run to kill the central switch and
+                       have the shadow take over, by default never.
+        :arg static: Give switches routes worked out from the layout instead
+                     of having them learn routes and flood.
+        """
 
-    def __init__(self, num_nodes: int, num_net: int) -> None:
         self.global_blocks = list()
         self.local_blocks = list()
         self.nodes = list()
         self.cas = list()
+        self.mode = mode
+        self.workers = workers
+        self.pool = None
+        self.jobs = list() # Threads running devices
+
+        # Hand the sim over to the event engine if requested, before any
+        # device reads the clock.
+
+        if (mode == "engine"):
+            engine.use(engine.Engine())
+        elif (mode == "async"):
+            engine.use(Runtime())
+        elif (mode == "thread"):
+            tops.RUN = tops.Quiescence()
 
         # Read firewall rules and send them to the central switch
 
-        with open("firewall.txt") as f:
-            for l in f.readlines():
-                m = match(r'(.*):.*', l)
-                if (m is None):
-                    raise Exception("Malformed firewall file!")
-                if ("#" in m[1]):
-                    tmp = m[1].split("_")[0]
-                    self.global_blocks.append(int(tmp))
-                else:
-                    tmp = m[1].split("_")[1]
-                    self.local_blocks.append(int(tmp))
-
-        # Set up central switch
-
-        self.css = Switch(0, self.global_blocks, self.local_blocks)
-        print(f"@@ CENTER SWITCH SETUP")
-
-        # Setup branch switches
-
-        nlist = []
-        tlist = {}
-        for x in range(1, num_net+1):
-            tmp = Switch(x, list(), list())
-            self.cas.append(tmp)
-            connect(tmp, self.css)
-            tlist[x] = tmp
-            nlist.append(x)
-        print(f"@@ BRANCH SWITCHES SETUP")
-
-
-        # setup nodes
-
-        ncount = cycle(nlist)
-        for x in range(num_nodes):
-            n = next(ncount)
-            tmp = Node(x, n)
-            connect(tmp, tlist[n])
-            self.nodes.append(tmp)
+        path = None
+        if (rules is None):
+            path = RULES
+            rules = firewall.load(RULES)
+        (self.global_blocks, self.local_blocks) = firewall.split(rules)
+
+        # Hand the switches and nodes off to their own processes if requested
+
+        if (mode == "shard"):
+            if ((layout is not None) or (traffic is not None)
+                or (failover is not None) or static):
+                raise Exception("Shard mode only runs the default layout and"
+                                " messages, without failover or static"
+                                " routes!")
+            self.css = None
+            self.shadow = None
+            shard.run(num_nodes, num_net, self.global_blocks,
+                      self.local_blocks, path, messages)
+            return
+
+        # Set up the central switch, the branch switches and the nodes, with
+        # any loops between switches blocked
+
+        if (layout is None):
+            layout = topology.star(num_nodes, num_net)
+        (self.css, self.cas, self.nodes) = layout.build(self.global_blocks,
+                                                        self.local_blocks,
+                                                        path)
+        logs.log(logs.INFO, None, "@@ SWITCHES AND NODES SETUP")
+
+        # Work out every route ahead of time if requested
+
+        if (static):
+            n = topology.forwarding([self.css] + self.cas)
+            logs.log(logs.INFO, None, "@@ {} STATIC ROUTES SETUP", n)
 
         # create .txt files if requested
 
@@ -89,50 +136,279 @@ class Main():
                     f.write("")
 
 
-        # Setup shadow switch
-        # Will take over if use_shadow is True (ie the main is dead)
+        # Setup shadow switch, kept up to date with the central switch so it
+        # can take over if it dies
 
         self.use_shadow = False
-        self.shadow = deepcopy(self.css)
-        print(f"@@ SHADOW SWITCH SETUP")
+        self.shadow = self.css.make_shadow()
+        logs.log(logs.INFO, None, "@@ SHADOW SWITCH SETUP")
 
         # Populate nodes with the inital messages they will send
 
         self.css.init_msg()
+        ids = [(x.net, x.name) for x in self.nodes]
         for x in self.nodes:
-            x.init_msg()
-        print(f"@@ NODES SETUP")
+            if (traffic is not None):
+                x.stream(traffic((x.net, x.name), ids))
+            else:
+                x.init_msg(None if (messages is None) else messages[x.node_id])
+        logs.log(logs.INFO, None, "@@ NODES SETUP")
 
-        # Dispatch threads for each device
+        # Kill the central switch part way through if requested, unless the
+        # sim is done first
+
+        timer = None
+        if ((failover is not None) and (mode == "engine")):
+            engine.ENGINE.schedule(failover, self.failover, timer=True)
+        elif ((failover is not None) and (mode == "async")):
+            engine.ENGINE.loop.call_later(failover, self.failover)
+        elif (failover is not None):
+            timer = Timer(failover, self.failover)
+            timer.daemon = True
+            timer.start()
+
+        if (mode == "engine"):
+            self.run_engine()
+        elif (mode == "async"):
+            self.run_async()
+        else:
+            self.run_threads(workers, shared_pool)
+
+        # Stop the failover if it has not happened, or let it finish if it is
+        # happening, before the shared pool it hands the shadow is shut down
+
+        if (timer is not None):
+            timer.cancel()
+            timer.join()
+        if (self.pool is not None):
+            self.pool.shutdown()
+            self.pool = None
+
+        # Make sure everything recorded is written out
+
+        writer.OUT.flush()
+
+    def run_engine(self) -> None:
+        """
+        Runs the sim as events on a virtual clock until every node is done.
+        """
+
+        e = engine.ENGINE
+        for x in self.nodes:
+            e.start(x)
+        e.run(lambda: not any(x.alive for x in self.nodes))
+        logs.log(logs.INFO, None, "@@ {} EVENTS IN {:.3f} VIRTUAL SEC",
+                 e.processed, e.now)
+        engine.use(None)
+
+    def run_async(self) -> None:
+        """
+        Runs the sim with a coroutine for each device until every node is
+        done.
+        """
+
+        engine.ENGINE.run([self.css, *self.cas, *self.nodes])
+        engine.use(None)
+
+    def failover(self) -> float:
+        """
+        Kills the central switch and moves its wires onto the shadow while
+        the sim runs, giving back how long (sec) the cut over took. There is
+        only one shadow, so this can only be done once.
+        """
+
+        if (self.shadow is None):
+            raise Exception("No shadow switch left to fail over to!")
+
+        t = time()
+        old = self.css
+        old.kill()
+        rewire(old, self.shadow)
+        (self.css, self.shadow) = (self.shadow, None)
+        self.use_shadow = True
+
+        # Get the new switch running the same way as the rest. On the engine
+        # frames are handed to whatever is on the end of the wire, so there
+        # is nothing to start.
+
+        if (self.mode == "async"):
+            engine.ENGINE.spawn(self.css)
+        elif (self.mode == "thread"):
+            self.css.workers = self.workers
+            self.css.pool = self.pool
+            tmp = Thread(target=self.css.job_loop, daemon=True)
+            self.jobs.append(tmp)
+            tmp.start()
+        t = time() - t
+        logs.log(logs.INFO, None,
+                 "@@ FAILED OVER TO SHADOW IN {:.6f} SEC WITH {} ROUTES", t,
+                 len(self.css.st))
+        return t
+
+    def run_threads(self, workers: int, shared_pool: bool) -> None:
+        """
+        Runs the sim with a thread for each device until every node is done.
+
+        :arg workers: Number of frame processing threads per pool.
+        :arg shared_pool: Use one pool for every device instead of one each.
+        """
+
+        # Size the worker pools for each device
 
         switch = [self.css, *self.cas]
+        if (shared_pool):
+            self.pool = Pool("SHARED", workers)
+        for x in [*switch, *self.nodes]:
+            x.workers = workers
+            x.pool = self.pool
+
+        # Dispatch threads for each device
+
         jobs = []
-        for x in switch:
+        for x in [*switch, *self.nodes]:
             tmp = Thread(target=x.job_loop, daemon=True)
             jobs.append(tmp)
 
-        wait_jobs = []
-        for x in self.nodes:
-            tmp = Thread(target=x.job_loop, daemon=True)
-            jobs.append(tmp)
-            wait_jobs.append(tmp)
+        # Count every node before any thread starts, so the sim can not look
+        # done before the last one is up
 
+        for x in self.nodes:
+            x.join()
         for x in jobs:
             x.start()
+        self.jobs.extend(jobs)
+
+        # Wait for devices to be done and every frame to be processed.
+
+        tops.RUN.wait()
+        logs.log(logs.INFO, None, "@@ QUIET")
+
+        # Wake every device to see it is done, and wait for them to stop so
+        # none are left to take frames of a later sim in this process
 
-        # Wait for devices to be done.
+        for x in list(wire.INBOXES.values()):
+            x.wake()
+        for x in list(self.jobs):
+            x.join()
 
-        while (GLOBAL_RUN.qsize()):
-            sleep(0.0000001)
+if (__name__ == "__main__"):
 
-# Parse cmd line args
+    # Parse cmd line args
 
-parser = argparse.ArgumentParser(description = 'A program for intro to networks project 3.')
-parser.add_argument('number_nodes', metavar='#Nodes', type=int,
-                    help='Number of nodes to spawn.')
-parser.add_argument('number_networks', metavar='#Networks', type=int,
-                    help='Number of networks to use.')
-args = parser.parse_args()
-print("STARTING SIM!")
-Main(args.number_nodes, args.number_networks)
-print("\n\nSHUTING DOWN REMAING THREADS:")
+    parser = argparse.ArgumentParser(
+        description = 'A program for intro to networks project 3.')
+    parser.add_argument('number_nodes', metavar='#Nodes', type=int,
+                        help='Number of nodes to spawn.')
+    parser.add_argument('number_networks', metavar='#Networks', type=int,
+                        help='Number of networks to use.')
+    parser.add_argument('--mode',
+                        choices=['thread', 'engine', 'async', 'shard'],
+                        default='thread',
+                        help=('Run with a thread per device, on a virtual'
+                              ' clock, with a coroutine per device or with a'
+                              ' process per switch.'))
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='Number of frame processing threads per pool.')
+    parser.add_argument('--shared-pool', action='store_true',
+                        help='Use one worker pool for every device.')
+    parser.add_argument('--log-level', choices=list(logs.LEVELS),
+                        default='debug', help='Lowest level of logs to keep.')
+    parser.add_argument('--log-device', action='append', default=None,
+                        help=('Only keep logs of this device'
+                              ' (ie 1_0, 0_SWITCH).'))
+    parser.add_argument('--log-binary', default=None,
+                        help=('Write logs to this binary file instead of'
+                              ' stdout.'))
+    parser.add_argument('--topology', default=None,
+                        help=('Layout to build, one of '
+                              + ', '.join(topology.SHAPES)
+                              + ' (with #Networks switches) or a topology'
+                              ' file.'))
+    parser.add_argument('--traffic', default=None,
+                        help=('Send messages as they go, in one of the'
+                              ' patterns ' + ', '.join(traffic.PATTERNS)
+                              + ' or replayed from a traffic file, instead of'
+                              ' from the node files.'))
+    parser.add_argument('--count', type=int, default=1,
+                        help=('Messages each node sends (to each other node'
+                              ' for all).'))
+    parser.add_argument('--gap', type=float, default=0.0,
+                        help='Time (sec) between messages of a node.')
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='Messages a second each node sends for poisson.')
+    parser.add_argument('--static', action='store_true',
+                        help=('Give switches routes worked out from the'
+                              ' layout, so they never learn routes or'
+                              ' flood.'))
+    parser.add_argument('--failover', type=float, default=None,
+                        help=('Kill the central switch this many seconds in'
+                              ' and have the shadow take over.'))
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Bytes a second each wire carries.')
+    parser.add_argument('--latency', type=float, default=None,
+                        help='Time (sec) a frame takes to cross a wire.')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='Most frames a wire holds before it is full.')
+    parser.add_argument('--policy', choices=["drop", "block"],
+                        default="drop",
+                        help=('Drop frames sent on a full wire or block the'
+                              ' sender until there is room (threads only).'))
+    parser.add_argument('--window', type=int, default=None,
+                        help=('Give frames sequence numbers and send at most'
+                              ' this many to a node before they are ACKed,'
+                              ' ACKing many at once with SACKs.'))
+    parser.add_argument('--ack-every', type=int, default=node.ACK_EVERY,
+                        help='Frames a node gets before it sends a SACK.')
+    parser.add_argument('--seed', default=None,
+                        help=('Seed the random errors of every device, so'
+                              ' runs in engine mode come out the same.'))
+    parser.add_argument('--capture', default=None,
+                        help='Record every frame sent to this trace file.')
+    parser.add_argument('--metrics', default=None,
+                        help=('Write metrics to this file at the end, as'
+                              ' Prometheus text if it ends in .prom or else'
+                              ' JSON.'))
+    parser.add_argument('--metrics-every', type=float, default=None,
+                        help=('Also write the metrics file every this many'
+                              ' seconds.'))
+    args = parser.parse_args()
+    if ((args.mode == "shard") and args.capture):
+        parser.error("Frames can not be captured in shard mode.")
+    logs.setup(logs.LEVELS[args.log_level],
+               set(args.log_device) if args.log_device else None,
+               logs.Binary(args.log_binary) if args.log_binary else None)
+    if (args.metrics and args.metrics_every):
+        metrics.dump_every(args.metrics, args.metrics_every)
+    layout = None
+    if (args.topology in topology.SHAPES):
+        layout = topology.SHAPES[args.topology](args.number_nodes,
+                                                args.number_networks)
+    elif (args.topology is not None):
+        layout = topology.load(args.topology)
+    pattern = None
+    if (args.traffic == "poisson"):
+        pattern = partial(traffic.poisson, rate=args.rate, count=args.count)
+    elif (args.traffic in traffic.PATTERNS):
+        pattern = partial(traffic.PATTERNS[args.traffic], count=args.count,
+                          gap=args.gap)
+    elif (args.traffic is not None):
+        pattern = partial(traffic.replay, path=args.traffic)
+    device.SEED = args.seed
+    node.WINDOW = args.window
+    node.ACK_EVERY = args.ack_every
+    wire.BANDWIDTH = args.bandwidth
+    wire.LATENCY = args.latency
+    wire.CAPACITY = args.capacity
+    wire.POLICY = args.policy
+    if (args.capture):
+        wire.TAP = capture.Capture(args.capture)
+    print("STARTING SIM!")
+    Main(args.number_nodes, args.number_networks, args.mode, args.workers,
+         args.shared_pool, layout=layout, traffic=pattern,
+         failover=args.failover, static=args.static)
+    logs.SINK.close()
+    if (wire.TAP is not None):
+        wire.TAP.close()
+    if (args.metrics):
+        metrics.dump(args.metrics)
+    print("\n\nSHUTING DOWN REMAING THREADS:")
@@ -0,0 +1,223 @@
+"""
+Used to count what happens on the network, so we can see where it is
+spending its time. Everything here can be read out as JSON or in the
+Prometheus text format while the sim is running or after.
+"""
+
+import json
+import os
+from bisect import bisect_left
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, List, Sequence, Tuple
+
+ENABLED = True # Turn off to make every update a no-op
+
+# Default buckets (sec) for timings
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = dict() # name -> metric
+
+class Metric():
+    """
+    Represents a named set of values, one for each set of label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = Lock()
+
+    def _labels(self, key: Tuple) -> str:
+        if (not key):
+            return ""
+        tmp = ",".join(f'{k}="{v}"' for (k, v) in zip(self.labels, key))
+        return "{" + tmp + "}"
+
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            return {",".join(f"{x}" for x in k): v
+                    for (k, v) in self.values.items()}
+
+    def prometheus(self) -> List[str]:
+        ret = [f"# HELP {self.name} {self.doc}",
+               f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for (k, v) in self.values.items():
+                ret.append(f"{self.name}{self._labels(k)} {v}")
+        return ret
+
+class Counter(Metric):
+    """
+    Represents a count that only goes up.
+    """
+
+    kind = "counter"
+
+    def inc(self, *key, n: int = 1) -> None:
+        if (not ENABLED):
+            return
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+
+class Gauge(Metric):
+    """
+    Represents a value that goes up and down.
+    """
+
+    kind = "gauge"
+
+    def inc(self, *key, n: float = 1) -> None:
+        if (not ENABLED):
+            return
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + n
+
+    def dec(self, *key, n: float = 1) -> None:
+        self.inc(*key, n=-n)
+
+    def set(self, *key, v: float) -> None:
+        if (not ENABLED):
+            return
+        with self.lock:
+            self.values[key] = v
+
+class Histogram(Metric):
+    """
+    Represents how often values land in each of a set of buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *key, v: float) -> None:
+        if (not ENABLED):
+            return
+        i = bisect_left(self.buckets, v)
+        with self.lock:
+            tmp = self.values.get(key, None)
+            if (tmp is None):
+
+                # One count per bucket plus one for past the last, then the
+                # sum and count of everything seen
+
+                tmp = [0] * (len(self.buckets) + 3)
+                self.values[key] = tmp
+            tmp[i] += 1
+            tmp[-2] += v
+            tmp[-1] += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            return {",".join(f"{x}" for x in k):
+                    {"buckets": dict(zip([*self.buckets, "+Inf"], v[:-2])),
+                     "sum": v[-2], "count": v[-1]}
+                    for (k, v) in self.values.items()}
+
+    def prometheus(self) -> List[str]:
+        ret = [f"# HELP {self.name} {self.doc}",
+               f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for (k, v) in self.values.items():
+                total = 0
+                for (b, c) in zip([*self.buckets, "+Inf"], v[:-2]):
+                    total += c
+                    ret.append(f"{self.name}_bucket"
+                               f"{self._bucket(k, b)} {total}")
+                ret.append(f"{self.name}_sum{self._labels(k)} {v[-2]}")
+                ret.append(f"{self.name}_count{self._labels(k)} {v[-1]}")
+        return ret
+
+    def _bucket(self, key: Tuple, b: object) -> str:
+        tmp = [f'{k}="{v}"' for (k, v) in zip(self.labels, key)]
+        tmp.append(f'le="{b}"')
+        return "{" + ",".join(tmp) + "}"
+
+def _add(m: Metric) -> Metric:
+    if (m.name in REGISTRY):
+        return REGISTRY[m.name]
+    REGISTRY[m.name] = m
+    return m
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    """
+    Gets or makes a counter.
+    """
+
+    return _add(Counter(name, doc, labels))
+
+def gauge(name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+    """
+    Gets or makes a gauge.
+    """
+
+    return _add(Gauge(name, doc, labels))
+
+def histogram(name: str, doc: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = BUCKETS) -> Histogram:
+    """
+    Gets or makes a histogram.
+    """
+
+    return _add(Histogram(name, doc, labels, buckets))
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    """
+    Gets the current value of every metric.
+    """
+
+    return {k: v.snapshot() for (k, v) in list(REGISTRY.items())}
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=1)
+
+def to_prometheus() -> str:
+    ret = list()
+    for x in list(REGISTRY.values()):
+        ret.extend(x.prometheus())
+    return "\n".join(ret) + "\n"
+
+def dump(path: str) -> None:
+    """
+    Writes every metric to a file, as Prometheus text if it ends in .prom
+    and JSON otherwise.
+    """
+
+    # Write next to it and swap it in so a reader never sees half a file
+
+    tmp = to_prometheus() if path.endswith(".prom") else to_json()
+    with open(path + ".tmp", "w") as f:
+        f.write(tmp)
+    os.replace(path + ".tmp", path)
+
+def dump_every(path: str, period: float) -> Thread:
+    """
+    Writes every metric to a file every period seconds while running.
+    """
+
+    def loop():
+        while (1):
+            sleep(period)
+            dump(path)
+
+    tmp = Thread(target=loop, name="[METRICS]", daemon=True)
+    tmp.start()
+    return tmp
+
+def reset() -> None:
+    """
+    Zeros every metric.
+    """
+
+    for x in list(REGISTRY.values()):
+        with x.lock:
+            x.values = dict()
@@ -2,18 +2,46 @@
 Represent an endpoint on the network.
 """
 
-from time import time
-from typing import List
+from collections import deque
+from threading import RLock
+from typing import Iterable, List, Optional, Tuple
 from device import Device
 from itertools import count
 from frame import (Frame, NAKv, get_type, make_frame, RULEv, is_valid, FType,
-make_ack, ACKv, RCKv)
+make_ack, ACKv, RCKv, SACKv, SEQv, PUSHv, split_seq, dump_sack, load_sack)
 from re import match
-from random import randint
-from wire import brodcast, Wire, send
+from wire import brodcast, Wire, send, HEARTBEAT
+from tracking import Tracker
+from dedup import Seen
+from engine import now
+import writer
+import logs
+import metrics
 
 MSG_TIMEOUT = 3 # How long to wait (sec) before trying to send again
 ERR = True # Do random errors as requested.
+IN_FLIGHT = 256 # Most frames waiting on ACKs before new ones are held back
+
+# With a window, frames to each node get sequence numbers and only WINDOW
+# of them are sent before they are ACKed. The reciver ACKs many at once
+# with a SACK, after ACK_EVERY frames or when the sender asks for one.
+
+WINDOW = None # Most frames to one node waiting on ACKs, None for no window
+ACK_EVERY = 8 # Frames from a node recieved before it is sent a SACK
+
+RECORDED = metrics.counter("node_frames_recorded",
+                           "Frames written to the output file.", ["node"])
+REJECTED = metrics.counter("node_frames_rejected",
+                           "Frames for the node ignored at random.", ["node"])
+RESENT = metrics.counter("node_frames_resent",
+                         "Frames sent again after timing out.", ["node"])
+NAKS = metrics.counter("node_naks", "NAKs sent for frames with a bad crc.",
+                       ["node"])
+SACKS = metrics.counter("node_sacks", "SACKs sent for sequenced frames.",
+                        ["node"])
+LATENCY = metrics.histogram("node_delivery_seconds",
+                            "Time from first sending a frame to its ACK.",
+                            ["node"])
 
 class Node(Device):
     """
@@ -22,80 +50,263 @@ class Node(Device):
 
     def __init__(self, name: int, net: int):
         super().__init__(name, net)
-        self.tracking_buffer = dict()
-        self.rcv_buffer = list()
+        self.tracking_buffer = Tracker(MSG_TIMEOUT)
+        self.rcv_buffer = Seen()
         self.node_id = f'{net}_{name}'
+        self.output = f"node{self.node_id}output.txt"
 
-    def init_msg(self) -> None:
+        # Messages still to come from a traffic pattern, and the next one
+
+        self.traffic = None
+        self.next_msg = None
+        self.started = 0.0
+        self.lock = RLock()
+
+        # With a window: the next sequence number, messages held back and
+        # sequence numbers waiting on ACKs for each node we send to, and
+        # [next expected, recieved past that, frames not yet ACKed] for each
+        # node we recieve from
+
+        self.seqs = dict()
+        self.held = dict()
+        self.out = dict()
+        self.got = dict()
+
+    def init_msg(self, msgs: List[Tuple[int, int, str]] = None) -> None:
         """
         Load the inital messages into the system.
+
+        :arg msgs: Messages to send as (net, node, data), by default read from
+                   the node file.
         """
 
         # Read node files
 
-        with open(f"node{self.node_id}.txt") as f:
-            tmp = f.readlines()
-            for x in tmp:
-                m = match(r'(.*)_(.*): (.*)', x)
-                if (m is None):
-                    raise Exception("Malformed Node File!")
+        if (msgs is None):
+            msgs = list()
+            with open(f"node{self.node_id}.txt") as f:
+                for x in f.readlines():
+                    m = match(r'(.*)_(.*): (.*)', x)
+                    if (m is None):
+                        raise Exception("Malformed Node File!")
+                    msgs.append((int(m[1]), int(m[2]), m[3]))
+
+        for (dn, dst, data) in msgs:
+            self.send_msg(dn, dst, data)
+
+    def stream(self, traffic: Iterable[Tuple[float, int, int, str]]) -> None:
+        """
+        Sends messages as (time, net, node, data) over time, time being
+        seconds from now. They are only made once they are due.
+        """
+
+        self.traffic = iter(traffic)
+        self.started = now()
+        self.next_msg = next(self.traffic, None)
+        self.wake()
 
-                # Construct frames
+    def send_msg(self, dn: int, dst: int, data: str) -> None:
+        """
+        Sends a message and tracks it for its ACK.
+        """
 
-                f = make_frame(int(m[1]),
-                               int(m[2]),
-                               self.net,
-                               self.name,
-                               100,
-                               m[3])
+        # With a window the message waits its turn behind the others to the
+        # same node
+
+        if (WINDOW is not None):
+            with self.lock:
+                seq = self.seqs.get((dn, dst), 0)
+                self.seqs[(dn, dst)] = seq + 1
+                self.held.setdefault((dn, dst), deque()).append((seq, data))
+            self.pump((dn, dst))
+            return
 
-                # Add frames to the tracking systems for ACKS
+        # Construct frames
 
-                self.tracking_buffer[time()] = f
+        f = make_frame(dn, dst, self.net, self.name, 100, data)
 
-                # Inject bad crc at at rate of 5%
+        # Add frames to the tracking systems for ACKS
 
-                if (ERR and (randint(1,100) < 5)):
-                    brodcast(self, f, crc=0b00000111)
-                    print(f">< ADDED BAD CRC TO: {f}")
-                else:
-                    brodcast(self, f)
+        self.track(f)
 
-    def check_resend(self, log: list) -> None:
+        self.transmit(f)
+
+    def transmit(self, f: Frame) -> None:
         """
-        Check to see if there are any unsent messages.
+        Sends a message frame for the first time.
         """
 
-        # Resend messages that have timed out
+        # Inject bad crc at at rate of 5%
 
-        update = list()
-        for k,v in self.tracking_buffer.items():
-            if ((k + MSG_TIMEOUT) < time()):
-                tmp = make_ack(v.dn, v.dst, v.sn, v.src, RCKv, v.data)
-                log.append(f"(| TRYING TO RESEND\n  {tmp}\n  VIA\n  BRODCAST")
-                update.append(k)
-                brodcast(self, tmp)
+        if (ERR and (self.rng.randint(1,100) < 5)):
+            brodcast(self, f, crc=0b00000111)
+            logs.log(logs.DEBUG, self, ">< ADDED BAD CRC TO: {}", f)
+        else:
+            brodcast(self, f)
 
-        # Reset sent messages send time to now
+    def pump(self, peer: Tuple[int, int]) -> None:
+        """
+        Sends the messages held back for a node while its window has room.
+        The last one sent asks for a SACK if nothing else is coming soon.
+        """
+
+        with self.lock:
+            q = self.held.get(peer, ())
+            out = self.out.setdefault(peer, set())
+            while (q and (len(out) < WINDOW)):
+                (seq, data) = q.popleft()
+                out.add(seq)
+                ack = SEQv
+                if ((len(out) >= WINDOW)
+                    or ((not q) and (self.next_msg is None))):
+                    ack |= PUSHv
+                f = make_frame(peer[0], peer[1], self.net, self.name, ack,
+                               f"{seq}|{data}")
+                self.track(f)
+                self.transmit(f)
+
+    def waiting(self) -> int:
+        """
+        Counts the messages sent or held back that are not ACKed yet.
+        """
+
+        return (len(self.tracking_buffer)
+                + sum(len(x) for x in list(self.held.values())))
+
+    def wake(self) -> None:
+        """
+        Sends the messages from the traffic pattern that are due, as long as
+        not too many are waiting on ACKs.
+        """
+
+        if (self.traffic is None):
+            return
+        with self.lock:
+            while ((self.next_msg is not None)
+                   and (self.started + self.next_msg[0] <= now())
+                   and (self.waiting() < IN_FLIGHT)):
+                (_, dn, dst, data) = self.next_msg
+                self.send_msg(dn, dst, data)
+                self.next_msg = next(self.traffic, None)
+            if (self.next_msg is None):
+                self.traffic = None
+
+    def next_wake(self) -> Optional[float]:
+        tmp = self.next_msg
+        if ((self.traffic is None) or (tmp is None)):
+            return None
+
+        # Once ACKs come back the next ones are sent right away, this is just
+        # in case they all time out
+
+        if (self.waiting() >= IN_FLIGHT):
+            return now() + HEARTBEAT
+        return self.started + tmp[0]
+
+    def done(self) -> bool:
+        """
+        Checks if every message has been sent and ACKed.
+        """
+
+        return (self.waiting() == 0) and (self.traffic is None)
+
+    def key(self, dn: int, dst: int, data: str) -> Tuple:
+        """
+        Gets what frames are tracked under, the sequence number standing in
+        for the data of sequenced frames.
+        """
 
-        for x in update:
-            tmp = self.tracking_buffer.pop(x)
-            self.tracking_buffer[time()] = tmp
+        if (WINDOW is not None):
+            return (dn, dst, split_seq(data)[0])
+        return (dn, dst, data)
+
+    def track(self, f: Frame) -> None:
+        """
+        Adds a frame to the tracking buffer under what its ACK will look like.
+        """
+
+        self.tracking_buffer.add(self.key(f.dn, f.dst, f.data), f)
+
+    def acked(self, peer: Tuple[int, int], cum: int,
+              ranges: List[Tuple[int, int]]) -> None:
+        """
+        Stops tracking the frames to a node a SACK says were recieved, and
+        sends more now that its window has room.
+        """
+
+        with self.lock:
+            out = self.out.get(peer, set())
+            for seq in list(out):
+                if ((seq < cum) or any(a <= seq <= b for (a, b) in ranges)):
+                    out.discard(seq)
+                    for (_, sent) in self.tracking_buffer.drop((*peer, seq)):
+                        LATENCY.observe(self.label, v=now() - sent)
+        self.pump(peer)
+        self.wake()
+
+    def sack(self, peer: Tuple[int, int], log: logs.Record) -> None:
+        """
+        Sends a node one SACK for every frame we have from it.
+        """
+
+        with self.lock:
+            g = self.got[peer]
+            g[2] = 0
+            tmp = make_ack(peer[0], peer[1], self.net, self.name, SACKv,
+                           dump_sack(g[0], g[1]))
+        SACKS.inc(self.label)
+        log.append("<| RESPONDING WITH\n  {}\n  VIA\n  BRODCAST", tmp)
+        brodcast(self, tmp)
+
+    def resend(self, f: Frame) -> Frame:
+        """
+        Gets a sequenced frame to send again, asking for a SACK right away.
+        """
+
+        return make_frame(f.dn, f.dst, f.sn, f.src, f.ack | PUSHv, f.data)
+
+    def check_resend(self, log: logs.Record) -> None:
+        """
+        Check to see if there are any unsent messages.
+        """
+
+        # Resend messages that have timed out, they are set to time out again
+        # from now.
+
+        for v in self.tracking_buffer.due():
+            if (v.ack & SEQv):
+                tmp = self.resend(v)
+            else:
+                tmp = make_ack(v.dn, v.dst, v.sn, v.src, RCKv, v.data)
+            log.append("(| TRYING TO RESEND\n  {}\n  VIA\n  BRODCAST", tmp)
+            brodcast(self, tmp)
+            RESENT.inc(self.label)
 
     def processes_frame(self, w: Wire, f: Frame):
 
         # Process Heart beat frames
 
         if ((w is None) and (f is None)):
-            log = ["<3 HEART BEAT"]
+            log = logs.start(logs.DEBUG, self)
+            log.append("<3 HEART BEAT")
+            self.wake()
             self.check_resend(log)
-            if (len(log) > 1):
-                print("\n".join(log))
-            return
 
-        # Set up log
+            # Frames left waiting on a SACK get one now
 
-        log =[("-"*40),f">| NODE {self.node_id} RECIVED:\n  {f}\n  VIA\n  {w}"]
+            for (peer, g) in list(self.got.items()):
+                if (g[2] > 0):
+                    self.sack(peer, log)
+
+            # A node that was given nothing to send may never get a frame to
+            # notice it is done on
+
+            if (self.alive and self.done()):
+                self.alive = False
+                log.append("XX ALL MESSAGES RECORDED. SHUTING DOWN {}.", self)
+            if (len(log) > 1):
+                log.flush()
+            return
 
         # Ignore messages that are not for me
 
@@ -104,11 +315,19 @@ class Node(Device):
         if (f.src == self.name):
             return
 
+        # Set up log, nothing in it is formatted unless it will be kept
+
+        log = logs.start(logs.DEBUG, self)
+        log.append(logs.BAR)
+        log.append(">| NODE {} RECIVED:\n  {}\n  VIA\n  {}", self.node_id, f,
+                   w)
+
         # Randomly (5%) ignore messages for me
 
-        if (ERR and (randint(1,100) < 5)):
+        if (ERR and (self.rng.randint(1,100) < 5)):
             log.append(">< RANDOMLY NOT ACCEPTING PACKET!")
-            print("\n".join(log))
+            REJECTED.inc(self.label)
+            log.flush()
             return
 
         # Identify what type of frame we have
@@ -118,60 +337,95 @@ class Node(Device):
 
         # Process frame acordingly
 
-        if (t == FType.MSG):
+        if ((t == FType.MSG) and (f.ack & SEQv) and is_valid(f)):
+
+            # Sequenced msgs are recorded once, anything seen before means
+            # our SACK was lost so we send another right away
+
+            (seq, data) = split_seq(f.data)
+            peer = (f.sn, f.src)
+            with self.lock:
+                g = self.got.setdefault(peer, [0, set(), 0])
+                new = (seq >= g[0]) and (seq not in g[1])
+                if (new):
+                    g[1].add(seq)
+                    while (g[0] in g[1]):
+                        g[1].remove(g[0])
+                        g[0] += 1
+                g[2] += 1
+            if (new):
+                writer.OUT.write(self.output, f'{f.sn}_{f.src}: {data}\n')
+                RECORDED.inc(self.label)
+                log.append("[] Frame Recorded.")
+            if ((not new) or (f.ack & PUSHv) or (g[2] >= ACK_EVERY)):
+                self.sack(peer, log)
+
+        elif (t == FType.MSG):
 
             # is msg with valid crc
 
             if (is_valid(f)):
-                with open(f"node{self.node_id}output.txt", "a") as o:
-                    o.write(f'{f.sn}_{f.src}: {f.data}\n')
-                    self.rcv_buffer.append((f.sn, f.src, f.dn, f.dst, f.data))
+                writer.OUT.write(self.output, f'{f.sn}_{f.src}: {f.data}\n')
+                self.rcv_buffer.add((f.sn, f.src, f.dn, f.dst, f.data))
+                RECORDED.inc(self.label)
                 tmp = make_ack(f.sn, f.src, f.dn, f.dst, ACKv, f.data)
                 brodcast(self, tmp)
-                log.append(f"[] Frame Recorded.")
-                log.append(f"<| RESPONDING WITH\n  {tmp}\n  VIA\n  BRODCAST")
+                log.append("[] Frame Recorded.")
+                log.append("<| RESPONDING WITH\n  {}\n  VIA\n  BRODCAST", tmp)
 
             # Msg with invalid crc
 
             else:
                 tmp = make_ack(f.sn, f.src, f.dn, f.dst, NAKv, f.data)
-                log.append(f"<| RESPONDING WITH\n  {tmp}\n  VIA\n  BRODCAST")
+                NAKS.inc(self.label)
+                log.append("<| RESPONDING WITH\n  {}\n  VIA\n  BRODCAST", tmp)
                 brodcast(self, tmp)
 
         # ACKs and responses from firewalls
 
+        elif (t == FType.SACK):
+            (cum, ranges) = load_sack(f.data)
+            self.acked((f.sn, f.src), cum, ranges)
+            log.append("|| NO RESPONSE NESSARY. MSGS MARKED AS SENT.\n")
+
+        elif ((t == FType.FAK) and (WINDOW is not None)):
+            seq = split_seq(f.data)[0]
+            self.acked((f.sn, f.src), 0, [(seq, seq)])
+            log.append("|| NO RESPONSE NESSARY. MSG MARKED AS SENT.\n")
+
         elif ((t == FType.ACK) or (t == FType.FAK)):
-            tmp = {x:v for x, v in self.tracking_buffer.items()
-                   if not((f.data == v.data) and (f.src == v.dst))}
-            self.tracking_buffer = tmp
-            log.append(f"|| NO RESPONSE NESSARY. MSG MARKED AS SENT.\n")
+            for (_, sent) in self.tracking_buffer.drop((f.sn, f.src, f.data)):
+                LATENCY.observe(self.label, v=now() - sent)
+            self.wake()
+            log.append("|| NO RESPONSE NESSARY. MSG MARKED AS SENT.\n")
 
         # Corection frame to make up for a bad CRC (NAC)
 
         elif (t == FType.RCK):
             if (not ((f.sn, f.src, f.dn, f.dst, f.data) in self.rcv_buffer)):
-                with open(f"node{self.node_id}output.txt", "a") as o:
-                    o.write(f'{f.sn}_{f.src}: {f.data}\n')
-                    self.rcv_buffer.append((f.sn, f.src, f.dn, f.dst, f.data))
+                writer.OUT.write(self.output, f'{f.sn}_{f.src}: {f.data}\n')
+                self.rcv_buffer.add((f.sn, f.src, f.dn, f.dst, f.data))
+                RECORDED.inc(self.label)
             tmp = make_ack(f.sn, f.src, f.dn, f.dst, ACKv, f.data)
-            log.append(f"<| RESPONDING WITH\n  {tmp}\n  VIA\n  BRODCAST")
+            log.append("<| RESPONDING WITH\n  {}\n  VIA\n  BRODCAST", tmp)
             brodcast(self, tmp)
 
         # NAC (request for a correction frame for a bad crc)
 
         elif (t == FType.NAK):
-            for x in self.tracking_buffer.values():
-                if ((x.dn, x.dst, x.data) == (f.sn, f.src, f.data)):
-                    brodcast(self, x)
-                    log.append(f"<| RESPONDING WITH\n  {x}\n  VIA\n  BRODCAST")
+            for x in self.tracking_buffer.find(self.key(f.sn, f.src, f.data)):
+                if (x.ack & SEQv):
+                    x = self.resend(x)
+                brodcast(self, x)
+                log.append("<| RESPONDING WITH\n  {}\n  VIA\n  BRODCAST", x)
 
         # Check to see if we have recieved acks for everything we wanted to
         # send and tell the sim
 
-        if (len(self.tracking_buffer) == 0):
+        if (self.done()):
             self.alive = False
-            log.append(f"XX ALL MESSAGES RECORDED. SHUTING DOWN {self}.")
-            print("\n".join(log))
+            log.append("XX ALL MESSAGES RECORDED. SHUTING DOWN {}.", self)
+            log.flush()
             return
 
         # Check to see if there are any messages that we want to retry sending.
@@ -181,5 +435,5 @@ class Node(Device):
 
         # Flush log
 
-        print("\n".join(log))
+        log.flush()
         return
@@ -0,0 +1,63 @@
+"""
+A bounded pool of worker threads that devices hand their frames off to.
+"""
+
+from queue import Queue
+from threading import Thread
+from traceback import print_exc
+from typing import Callable
+
+WORKERS = 4 # How many threads process frames for each pool
+BACKLOG = 256 # How many jobs can wait on a pool before submitting blocks
+
+class Pool():
+    """
+    Represents a fixed set of threads pulling jobs off a bounded queue.
+    """
+
+    def __init__(self, name: str = "POOL", workers: int = WORKERS,
+                 backlog: int = BACKLOG):
+        self.jobs = Queue(backlog)
+        self.threads = list()
+        for x in range(workers):
+            tmp = Thread(target=self.work, name=f"[{name}-{x}]", daemon=True)
+            self.threads.append(tmp)
+            tmp.start()
+
+    def submit(self, fn: Callable, *args) -> None:
+        """
+        Queues fn(*args) to be ran, blocking while the pool is backed up.
+        """
+
+        self.jobs.put((fn, args))
+
+    def work(self) -> None:
+        """
+        Runs jobs until told to stop.
+        """
+
+        while (1):
+            job = self.jobs.get()
+
+            # An empty job is the signal to exit
+
+            if (job is None):
+                return
+
+            # Keep the worker alive if a job blows up
+
+            (fn, args) = job
+            try:
+                fn(*args)
+            except Exception:
+                print_exc()
+
+    def shutdown(self) -> None:
+        """
+        Finishes any queued jobs then stops the workers.
+        """
+
+        for x in self.threads:
+            self.jobs.put(None)
+        for x in self.threads:
+            x.join()
@@ -0,0 +1,234 @@
+"""
+Runs the sim across processes, one for the central switch and one for each
+branch switch with its nodes. Trunk wires between them are carried over
+shared memory rings of encoded frames.
+"""
+
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+import tops
+import wire
+import writer
+import logs
+from device import Device
+from node import Node
+from switch import Switch
+from wire import connect, deliver, taken, HEARTBEAT, LINKS, INBOXES
+from firewall import RULES
+
+RING_SIZE = 1 << 20 # How many bytes of frames a trunk can hold
+FULL_WAIT = 0.0001 # How long (sec) a writer backs off when a ring is full
+
+INDEX = Struct("<QQ") # Total bytes read and written, at the head of the ring
+POS = Struct("<Q") # One of the two above
+LENGTH = Struct("<I") # Size of each frame in the ring
+
+class Ring():
+    """
+    Represents a single producer single consumer queue of frames in shared
+    memory.
+    """
+
+    def __init__(self, ctx: mp.context.BaseContext, size: int = RING_SIZE):
+        self.shm = SharedMemory(create=True, size=INDEX.size + size)
+        self.size = size
+        self.items = ctx.Semaphore(0)
+        INDEX.pack_into(self.shm.buf, 0, 0, 0)
+
+    def _copy_in(self, pos: int, b: bytes) -> None:
+        pos %= self.size
+        cut = min(len(b), self.size - pos)
+        base = INDEX.size
+        self.shm.buf[base+pos:base+pos+cut] = b[:cut]
+        self.shm.buf[base:base+len(b)-cut] = b[cut:]
+
+    def _copy_out(self, pos: int, n: int) -> bytes:
+        pos %= self.size
+        cut = min(n, self.size - pos)
+        base = INDEX.size
+        return (bytes(self.shm.buf[base+pos:base+pos+cut])
+                + bytes(self.shm.buf[base:base+n-cut]))
+
+    def qsize(self) -> int:
+        (head, tail) = INDEX.unpack_from(self.shm.buf, 0)
+        return tail - head
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put(self, msg: bytes) -> None:
+        """
+        Writes a frame, waiting while the ring is full.
+        """
+
+        rec = LENGTH.pack(len(msg)) + msg
+        if (len(rec) > self.size):
+            raise Exception("Frame larger than ring.")
+
+        # Wait for the reader to make room
+
+        while (self.size - self.qsize() < len(rec)):
+            sleep(FULL_WAIT)
+
+        # Write the frame before moving the tail so the reader never sees a
+        # half written frame
+
+        (head, tail) = INDEX.unpack_from(self.shm.buf, 0)
+        self._copy_in(tail, rec)
+        POS.pack_into(self.shm.buf, POS.size, tail + len(rec))
+        self.items.release()
+
+    def get(self, timeout: float = None) -> Optional[bytes]:
+        """
+        Reads a frame, waiting up to timeout seconds for one.
+        """
+
+        if (not self.items.acquire(timeout=timeout)):
+            return None
+        (head, tail) = INDEX.unpack_from(self.shm.buf, 0)
+        n = LENGTH.unpack(self._copy_out(head, LENGTH.size))[0]
+        msg = self._copy_out(head + LENGTH.size, n)
+        POS.pack_into(self.shm.buf, 0, head + LENGTH.size + n)
+        return msg
+
+    def close(self) -> None:
+        """
+        Frees the shared memory.
+        """
+
+        self.shm.close()
+        self.shm.unlink()
+
+class Trunk():
+    """
+    Stands in for the inbox of a device in another process, sending what is
+    put in it over a ring.
+    """
+
+    def __init__(self, ring: Ring):
+        self.ring = ring
+        self.lock = Lock() # Only one writer is allowed on a ring
+        self.reading = True # The other process is always taking frames off
+
+    def __len__(self) -> int:
+        return self.ring.qsize()
+
+    def put(self, link: wire.Wire, msg: bytes, at: float = None) -> None:
+
+        # The frame is off our end of the wire once it is in the ring, the
+        # time it takes to cross is only kept on the other side
+
+        with self.lock:
+            self.ring.put(msg)
+        taken(link)
+
+def pump(ring: Ring, link: wire.Wire) -> None:
+    """
+    Moves frames coming in over a ring onto the local end of a trunk wire.
+    """
+
+    while (1):
+        msg = ring.get(HEARTBEAT)
+        if (msg is not None):
+
+            # The frame was counted in flight when it went in the ring, now it
+            # is counted again on this side
+
+            deliver(link, msg)
+            tops.RUN.landed()
+
+def trunk(local: Device, remote: Device, out: Ring, into: Ring) -> None:
+    """
+    Connects a local device to a device in another process.
+    """
+
+    connect(local, remote)
+    INBOXES[remote] = Trunk(out)
+    tmp = Thread(target=pump, args=(into, LINKS[(remote, local)]),
+                 daemon=True)
+    tmp.start()
+
+def run_center(num_net: int, global_blocks: List[str],
+               local_blocks: List[str], up: List[Ring],
+               down: List[Ring], rules: str = RULES) -> None:
+    """
+    Runs the central switch.
+    """
+
+    css = Switch(0, global_blocks, local_blocks, name=-1, rules=rules)
+    for x in range(1, num_net+1):
+        trunk(css, Device(-(x+1), x), down[x-1], up[x-1])
+    logs.log(logs.INFO, css, "@@ CENTER SWITCH SETUP")
+
+    css.init_msg()
+    Thread(target=css.job_loop, daemon=True).start()
+    tops.RUN.wait()
+
+def run_branch(net: int, num_nodes: int, num_net: int, up: Ring,
+               down: Ring, messages: Dict[str, List[Tuple]] = None) -> None:
+    """
+    Runs a branch switch and the nodes on its network.
+    """
+
+    cas = Switch(net, list(), list(), name=-(net+1))
+    trunk(cas, Device(-1, 0), up, down)
+    nodes = list()
+    for x in range(num_nodes):
+        if ((x % num_net) + 1 == net):
+            tmp = Node(x, net)
+            connect(tmp, cas)
+            nodes.append(tmp)
+    logs.log(logs.INFO, cas, "@@ BRANCH {} SETUP", net)
+
+    # Our nodes were counted as running before we were forked, so the others
+    # can not close before they are up
+
+    for x in nodes:
+        x.joined = True
+        x.init_msg(None if (messages is None) else messages[x.node_id])
+    for x in [cas, *nodes]:
+        Thread(target=x.job_loop, daemon=True).start()
+    tops.RUN.wait()
+
+    # Processes dont run exit handlers, so write out what was recorded
+
+    writer.OUT.close()
+
+def run(num_nodes: int, num_net: int, global_blocks: List[str],
+        local_blocks: List[str], rules: str = RULES,
+        messages: Dict[str, List[Tuple]] = None) -> None:
+    """
+    Runs the sim with a process for each switch.
+
+    :arg rules: Rules file the central switch reloads from, if any.
+    :arg messages: Messages each node sends, see Main.
+    """
+
+    ctx = mp.get_context("fork")
+    up = [Ring(ctx) for x in range(num_net)]
+    down = [Ring(ctx) for x in range(num_net)]
+
+    # Share what is left to do with every process, with every node counted
+    # up front
+
+    tops.RUN = tops.Quiescence(ctx)
+    tops.RUN.join(num_nodes)
+
+    jobs = [ctx.Process(target=run_center,
+                        args=(num_net, global_blocks, local_blocks, up, down,
+                              rules))]
+    for x in range(1, num_net+1):
+        jobs.append(ctx.Process(target=run_branch,
+                                args=(x, num_nodes, num_net, up[x-1],
+                                      down[x-1], messages)))
+    for x in jobs:
+        x.start()
+    for x in jobs:
+        x.join()
+    for x in [*up, *down]:
+        x.close()
+    tops.RUN = tops.Quiescence()
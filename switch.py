@@ -2,36 +2,142 @@
 Used to conect nodes on the network.
 """
 
-from time import time
-from typing import List
+from collections import OrderedDict
+from engine import now
+from threading import Lock
+from typing import List, Optional, Tuple
 from device import Device
 from itertools import count
-from frame import FAKv, Frame, make_ack, RULEv, FType, get_type
-from random import randint
-from wire import LINK_PAIRS, brodcast, Wire, send
+from frame import (FAKv, Frame, make_ack, RULEv, FType, get_type,
+dump_frame)
+from wire import LINK_PAIRS, WRITE_LINKS, brodcast, deliver, Wire, send
+from firewall import Firewall, REMOVE
+import firewall
+import logs
+import metrics
 
 TOP_SWITCH = count(1) # Keep tack of the number of swithches globaly
-ST_TIME = 3 # How long to wait before in flusing the ST
+ST_TIME = 3 # How long (sec) a route stays in the ST without being seen
+ST_SIZE = 4096 # Most routes the ST holds before dropping the oldest used
 ERR = True # Should the swithc drom random frames
 
+FORWARDED = metrics.counter("switch_frames_forwarded",
+                            "Frames sent out the one port in the ST.",
+                            ["switch"])
+FLOODED = metrics.counter("switch_frames_flooded",
+                          "Frames sent out every port but the one they came"
+                          " in on.", ["switch"])
+FILTERED = metrics.counter("switch_frames_filtered",
+                           "Frames dropped as they were already on the port"
+                           " for their device.", ["switch"])
+BLOCKED = metrics.counter("switch_frames_blocked",
+                          "Frames turned back by the firewall.", ["switch"])
+DROPPED = metrics.counter("switch_frames_dropped",
+                          "Frames dropped at random.", ["switch"])
+UNROUTED = metrics.counter("switch_frames_unrouted",
+                           "Frames dropped as their device is not in the"
+                           " static routes.", ["switch"])
+
+class Table():
+    """
+    Represents the switching table. Each route ages out on its own, and the
+    least recently used route makes way once the table is full.
+    """
+
+    def __init__(self, ttl: float = ST_TIME, size: int = ST_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.routes = OrderedDict() # (net, name) -> (wire, time last seen)
+        self.lock = Lock()
+        self.mirror = None # Table of a standby switch to copy routes to
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def learn(self, key: Tuple[int, int], link: Wire) -> None:
+        """
+        Records the wire a device can be reached by.
+        """
+
+        with self.lock:
+            self.routes[key] = (link, now())
+            self.routes.move_to_end(key)
+            if (len(self.routes) > self.size):
+                self.routes.popitem(last=False)
+        if (self.mirror is not None):
+            self.mirror.learn(key, link)
+
+    def lookup(self, key: Tuple[int, int]) -> Optional[Wire]:
+        """
+        Finds the wire a device can be reached by, if known and not stale.
+        """
+
+        with self.lock:
+            tmp = self.routes.get(key, None)
+            if (tmp is None):
+                return None
+            if ((tmp[1] + self.ttl) < now()):
+                del self.routes[key]
+                return None
+            self.routes.move_to_end(key)
+            return tmp[0]
+
 class Switch(Device):
     """
     Represents a switch in the system.
     """
 
-    def __init__(self, net:int, global_blocks: List[int] = list(),
-                 local_blocks: List[int] = list()):
-        tmp = next(TOP_SWITCH) * -1
-        super().__init__(tmp, net)
-        self.global_blocks = global_blocks
-        self.local_blocks = list()
-        self.lc = local_blocks
+    def __init__(self, net:int, global_blocks: List[str] = list(),
+                 local_blocks: List[str] = list(), name: int = None,
+                 rules: str = None):
+        """
+        :arg global_blocks: Rules this switch enforces.
+        :arg local_blocks: Rules sent out to the other switches.
+        :arg rules: Firewall file to reload the rules from when it changes.
+        """
+
+        if (name is None):
+            name = next(TOP_SWITCH) * -1
+        super().__init__(name, net)
+        self.fw = Firewall(global_blocks, rules)
+        self.lc = list(local_blocks)
+        self.standby = None # Shadow kept up to date to take over from us
+        self.dead = False
+
+        # Set up ST, unless given static routes ((net, name) -> wire) worked
+        # out ahead of time, see topology.forwarding
 
-        # Set up ST
+        self.st = Table()
+        self.static = None
 
-        self.st = dict()
-        self.st_exp = time()
+    def make_shadow(self) -> "Switch":
+        """
+        Makes a standby copy of the switch, sent every route learned and
+        rule changed from then on so it can take over at any time.
+        """
+
+        tmp = Switch(self.net, list(), self.lc)
+        tmp.label = f"{self.label}_SHADOW"
+        tmp.fw.path = self.fw.path
+        tmp.fw.mtime = self.fw.mtime
+        tmp.fw.replace(self.fw.rules)
+        self.fw.mirror = tmp.fw
+        tmp.static = self.static
+        with self.st.lock:
+            tmp.st.routes = OrderedDict(self.st.routes)
+            self.st.mirror = tmp.st
+        self.standby = tmp
+        return tmp
+
+    def kill(self) -> None:
+        """
+        Stops the switch dead, any frames it gets from now on are lost.
+        """
 
+        self.dead = True
+        self.st.mirror = None
+        self.fw.mirror = None
+        self.standby = None
 
     def init_msg(self) -> None:
         """
@@ -42,8 +148,55 @@ class Switch(Device):
             f = make_ack(100, 100, 100, 100, RULEv, str(rule))
             brodcast(self, f)
 
+    def check_rules(self) -> None:
+        """
+        Reloads the firewall file if it has changed, sending out any changes
+        to the local rules.
+        """
+
+        if (not self.fw.changed()):
+            return
+        try:
+            (g, l) = firewall.split(firewall.load(self.fw.path))
+        except Exception as e:
+            logs.log(logs.WARN, self,
+                     "$$ KEEPING OLD RULES, BAD FIREWALL FILE: {}", e)
+            return
+        self.fw.replace(g)
+        if (self.standby is not None):
+            self.standby.lc = list(l)
+        for rule in [x for x in l if (x not in self.lc)]:
+            brodcast(self, make_ack(100, 100, 100, 100, RULEv, rule))
+        for rule in [x for x in self.lc if (x not in l)]:
+            brodcast(self, make_ack(100, 100, 100, 100, RULEv, REMOVE + rule))
+        self.lc = l
+        logs.log(logs.INFO, self, "$$ RELOADED RULES: {} SENT {}", self.fw,
+                 self.lc)
+
+    def pass_rule(self, w: Wire, f: Frame) -> None:
+        """
+        Passes a new rule on to the switches past this one, so rules reach
+        every level of a tree.
+        """
+
+        msg = dump_frame(f, force_crc=f.crc, do_crc=False)
+        for link in WRITE_LINKS[self]:
+            if ((link.blocked) or (link.read is w.write)
+                or (not isinstance(link.read, Switch))):
+                continue
+            deliver(link, msg)
+
     def processes_frame(self, w: Wire, f: Frame):
 
+        # A dead switch does nothing with the frames still coming to it
+
+        if (self.dead):
+            return
+
+        # Pick up changes to the firewall file
+
+        self.check_rules()
+
         # Ignore hartbeat frames
 
         if ((w is None) and (f is None)):
@@ -51,62 +204,84 @@ class Switch(Device):
 
         # Init log
 
-        log =[("-"*40),f">| SWITCH {self.net} RECIVED:\n  {f}\n  VIA\n  {w}"]
+        log = logs.start(logs.DEBUG, self)
+        log.append(logs.BAR)
+        log.append(">| SWITCH {} RECIVED:\n  {}\n  VIA\n  {}", self.net, f, w)
 
         # add any rules to our local firewall
 
         if (get_type(f) == FType.RULE):
-            self.local_blocks.append(int(f.data))
-            log.append(f"$$ RULES: {self.local_blocks}")
-            print("\n".join(log))
+            if (self.fw.add(f.data)):
+                self.pass_rule(w, f)
+            log.append("$$ RULES: {}", self.fw)
+            log.flush()
             return
 
-        # Flush ST if time
-
-        if ((self.st_exp + ST_TIME) < time()):
-            self.st = dict()
-            self.st_exp = time()
-
         # Learn new route of given frame in ST
 
         hnet = w.write.net
         hname = w.write.name
         inverse_wire = LINK_PAIRS[(self, hnet, hname)]
-        self.st[(f.sn, f.src)] = inverse_wire
+        if (self.static is None):
+            self.st.learn((f.sn, f.src), inverse_wire)
 
         # Check to see if the frame is blocked by the firewall
 
-        if ((f.dn in self.global_blocks) or (f.dst in self.local_blocks)):
+        blocked = False
+        if (self.fw.blocks(f)):
             if ((f.dn != f.sn) and (get_type(f) in [FType.MSG, FType.RCK])):
-                log.append(f"\\ BLOCKED")
+                log.append("\\ BLOCKED")
+                BLOCKED.inc(self.label)
                 f = make_ack(f.sn, f.src, f.dn, f.dst, FAKv, f.data)
+                blocked = True
 
         # if not find next hop via ST
 
-        next_hop = self.st.get((f.dn, f.dst), None)
+        if (self.static is None):
+            next_hop = self.st.lookup((f.dn, f.dst))
+        else:
+            next_hop = self.static.get((f.dn, f.dst), None)
 
         # Randomly (5%) drop frames
 
-        if (ERR and (randint(1,100) < 5)):
-            log.append(f">< RANDOMLY DROPING FRAME!")
-            print("\n".join(log))
+        if (ERR and (self.rng.randint(1,100) < 5)):
+            log.append(">< RANDOMLY DROPING FRAME!")
+            DROPPED.inc(self.label)
+            log.flush()
             return
 
+        # Drop frames for a device behind the port they came in on, sending
+        # them back would teach the last switch the wrong port for the sender.
+        # Without the whole ST being flushed every so often, that would keep
+        # frames looping between two switches.
+
+        if ((next_hop is inverse_wire) and (not blocked)):
+            log.append("<| FILTERING, ALREADY ON {}", w)
+            FILTERED.inc(self.label)
+
+        # Static routes know every device, so there is nothing to flood to
+
+        elif ((next_hop is None) and (self.static is not None)):
+            log.append("<| NO ROUTE, DROPPING")
+            UNROUTED.inc(self.label)
+
         # Flood the sent frame
 
-        if (next_hop is None):
+        elif (next_hop is None):
             brodcast(self, f, w)
-            log.append(f"<| BRODCASTING EXCEPT {inverse_wire}")
+            log.append("<| BRODCASTING EXCEPT {}", inverse_wire)
+            FLOODED.inc(self.label)
 
         # Send single frame
 
         else:
             send(next_hop.write, f, next_hop.read)
-            log.append(f"<| FORWADING VIA {next_hop}")
+            log.append("<| FORWADING VIA {}", next_hop)
+            FORWARDED.inc(self.label)
 
         # Flush log
 
-        print("\n".join(log))
+        log.flush()
         return
 
 
@@ -0,0 +1,302 @@
+"""
+Used to lay out the switches and nodes of the network, either read from a
+file or built in code, and to keep frames from looping around it.
+
+A topology file has one entry per line:
+
+    switch core 0     a switch called core on network 0
+    switch a 1        a switch called a on network 1
+    link core a       a wire between two switches
+    link a b latency=0.01 bandwidth=1e6 capacity=64 policy=block
+                      a wire with its own latency (sec), bandwidth (bytes a
+                      second), capacity (frames) and policy when full
+    node 3 a          node 3 on switch a, and so on network 1
+    root core         the switch holding the firewall, by default the first
+
+Anything after a # is ignored.
+
+Switches flood frames they have no route for out of every other port, so
+any loop of switches would pass frames around it forever. Once built, the
+wires not on a spanning tree from the root are blocked and never carry
+frames. Switches can instead be given static routes over the tree, so they
+never learn or flood at all.
+
+Global firewall rules are only checked by the root, so they only catch
+frames that pass through it. Local rules are passed on to every switch.
+"""
+
+from collections import deque
+from typing import Dict, List, Tuple
+from node import Node
+from switch import Switch
+from wire import WRITE_LINKS, connect
+import logs
+
+class Topology():
+    """
+    Represents the layout of a network before it is built.
+    """
+
+    def __init__(self):
+        self.switches = dict() # key -> net
+        self.nodes = list() # (name, switch key)
+        self.ids = set() # (net, name) of every node, which must be unique
+        self.links = list() # (switch key, switch key, wire settings)
+        self.root = None
+
+    def __repr__(self) -> str:
+        return (f"{len(self.switches)} SWITCHES, {len(self.nodes)} NODES,"
+                f" {len(self.links)} LINKS")
+
+    def switch(self, key: str, net: int) -> None:
+        """
+        Adds a switch, the first one added is the root unless set otherwise.
+        """
+
+        if (key in self.switches):
+            raise Exception(f"Switch {key} already exists!")
+        self.switches[key] = net
+        if (self.root is None):
+            self.root = key
+
+    def link(self, a: str, b: str, **kw) -> None:
+        """
+        Adds a wire between two switches.
+
+        :arg kw: What the wire is like, as for wire.connect.
+        """
+
+        if ((a not in self.switches) or (b not in self.switches)):
+            raise Exception(f"Unknown switch in link {a} {b}!")
+        self.links.append((a, b, kw))
+
+    def node(self, name: int, key: str) -> None:
+        """
+        Adds a node on a switch, and so on the network of the switch.
+        """
+
+        if (key not in self.switches):
+            raise Exception(f"Unknown switch {key}!")
+        tmp = (self.switches[key], name)
+        if (tmp in self.ids):
+            raise Exception(f"Node {tmp[0]}_{name} already exists!")
+        self.ids.add(tmp)
+        self.nodes.append((name, key))
+
+    def build(self, global_blocks: List[str] = list(),
+              local_blocks: List[str] = list(),
+              rules: str = None) -> Tuple[Switch, List[Switch], List[Node]]:
+        """
+        Makes and connects the devices, giving back the root switch, the
+        other switches and the nodes. The firewall rules go to the root.
+        """
+
+        # Make the root first so it gets the first switch name
+
+        devs = dict()
+        devs[self.root] = Switch(self.switches[self.root], global_blocks,
+                                 local_blocks, rules=rules)
+        for (k, net) in self.switches.items():
+            if (k != self.root):
+                devs[k] = Switch(net, list(), list())
+        for (a, b, kw) in self.links:
+            connect(devs[a], devs[b], **kw)
+
+        nodes = list()
+        for (name, k) in self.nodes:
+            tmp = Node(name, devs[k].net)
+            connect(tmp, devs[k])
+            nodes.append(tmp)
+
+        root = devs[self.root]
+        n = spanning_tree(root)
+        logs.log(logs.INFO, None, "@@ BUILT {}, {} LINKS BLOCKED", self, n)
+        return (root, [x for x in devs.values() if (x is not root)], nodes)
+
+def spanning_tree(root: Switch) -> int:
+    """
+    Blocks every wire between switches that is not on the shortest path
+    tree from the root, giving back how many links were blocked.
+    """
+
+    # Walk out from the root, keeping the first wire each switch is reached
+    # by
+
+    seen = {root}
+    keep = set() # (write, read) of each wire on the tree
+    todo = deque([root])
+    while (todo):
+        x = todo.popleft()
+        for link in WRITE_LINKS.get(x, ()):
+            if (not isinstance(link.read, Switch)):
+                continue
+            if (link.read not in seen):
+                seen.add(link.read)
+                keep.add((x, link.read))
+                keep.add((link.read, x))
+                todo.append(link.read)
+
+    # Block both ways of the rest
+
+    ret = 0
+    for x in seen:
+        for link in WRITE_LINKS.get(x, ()):
+            if (isinstance(link.read, Switch)):
+                link.blocked = (x, link.read) not in keep
+                ret += link.blocked
+    return ret // 2
+
+def forwarding(switches: List[Switch]) -> int:
+    """
+    Gives each switch static routes to every node, the first wire on the
+    shortest path to it over wires that are not blocked. Gives back how many
+    routes were made.
+    """
+
+    ret = 0
+    for sw in switches:
+
+        # Walk out from the switch, each device taking the first hop of the
+        # device it was reached from
+
+        tmp = dict()
+        seen = {sw}
+        todo = deque()
+        for link in WRITE_LINKS.get(sw, ()):
+            if ((not link.blocked) and (link.read not in seen)):
+                seen.add(link.read)
+                todo.append((link.read, link))
+        while (todo):
+            (x, hop) = todo.popleft()
+            if (not isinstance(x, Switch)):
+                tmp[(x.net, x.name)] = hop
+                continue
+            for link in WRITE_LINKS.get(x, ()):
+                if ((not link.blocked) and (link.read not in seen)):
+                    seen.add(link.read)
+                    todo.append((link.read, hop))
+        sw.static = tmp
+        ret += len(tmp)
+    return ret
+
+def load(path: str) -> Topology:
+    """
+    Reads a topology file.
+    """
+
+    ret = Topology()
+    root = None
+    with open(path) as f:
+        for l in f.readlines():
+            tmp = l.split("#")[0].split()
+            if (not tmp):
+                continue
+            try:
+                if ((tmp[0] == "switch") and (len(tmp) == 3)):
+                    ret.switch(tmp[1], int(tmp[2]))
+                elif ((tmp[0] == "link") and (len(tmp) >= 3)):
+                    ret.link(tmp[1], tmp[2], **_settings(tmp[3:]))
+                elif ((tmp[0] == "node") and (len(tmp) == 3)):
+                    ret.node(int(tmp[1]), tmp[2])
+                elif ((tmp[0] == "root") and (len(tmp) == 2)):
+                    root = tmp[1]
+                else:
+                    raise Exception(f"Unknown entry {l.strip()}")
+            except ValueError:
+                raise Exception("Malformed topology file!")
+    if (root is not None):
+        if (root not in ret.switches):
+            raise Exception(f"Unknown root switch {root}!")
+        ret.root = root
+    return ret
+
+def _settings(l: List[str]) -> Dict[str, object]:
+    """
+    Reads the KEY=VALUE wire settings of a link entry.
+    """
+
+    ret = dict()
+    for x in l:
+        (k, _, v) = x.partition("=")
+        if (k in ("bandwidth", "latency")):
+            ret[k] = float(v)
+        elif (k == "capacity"):
+            ret[k] = int(v)
+        elif (k == "policy"):
+            ret[k] = v
+        else:
+            raise Exception(f"Unknown wire setting {x}!")
+    return ret
+
+def _spread(t: Topology, num_nodes: int, keys: List[str]) -> None:
+    """
+    Hands out nodes to switches in turn.
+    """
+
+    for x in range(num_nodes):
+        t.node(x, keys[x % len(keys)])
+
+def star(num_nodes: int, num_net: int) -> Topology:
+    """
+    Makes a central switch with a branch switch for each network.
+    """
+
+    ret = Topology()
+    ret.switch("0", 0)
+    for x in range(1, num_net+1):
+        ret.switch(f"{x}", x)
+        ret.link(f"{x}", "0")
+    _spread(ret, num_nodes, [f"{x}" for x in range(1, num_net+1)])
+    return ret
+
+def tree(num_nodes: int, fanout: int, depth: int = 2) -> Topology:
+    """
+    Makes a tree of switches depth levels below the root, with the nodes on
+    the bottom level.
+    """
+
+    ret = Topology()
+    ret.switch("0", 0)
+    level = ["0"]
+    net = 1
+    for x in range(depth):
+        tmp = list()
+        for parent in level:
+            for i in range(fanout):
+                ret.switch(f"{net}", net)
+                ret.link(f"{net}", parent)
+                tmp.append(f"{net}")
+                net += 1
+        level = tmp
+    _spread(ret, num_nodes, level)
+    return ret
+
+def ring(num_nodes: int, num_net: int) -> Topology:
+    """
+    Makes a ring of switches, one for each network.
+    """
+
+    ret = Topology()
+    for x in range(1, num_net+1):
+        ret.switch(f"{x}", x)
+    for x in range(1, num_net+1):
+        if ((num_net > 2) or (x < num_net)):
+            ret.link(f"{x}", f"{(x % num_net) + 1}")
+    _spread(ret, num_nodes, [f"{x}" for x in range(1, num_net+1)])
+    return ret
+
+def mesh(num_nodes: int, num_net: int) -> Topology:
+    """
+    Makes a switch for each network with a wire between every two of them.
+    """
+
+    ret = Topology()
+    for x in range(1, num_net+1):
+        ret.switch(f"{x}", x)
+    for x in range(1, num_net+1):
+        for y in range(x+1, num_net+1):
+            ret.link(f"{x}", f"{y}")
+    _spread(ret, num_nodes, [f"{x}" for x in range(1, num_net+1)])
+    return ret
+
+SHAPES = {"star": star, "tree": tree, "ring": ring, "mesh": mesh}
@@ -1,5 +1,78 @@
 """
-A simple module to hold the global lock for the sim.
+A simple module to hold what is left to do in the sim, so we know when it
+can close.
 """
-from queue import Queue
-GLOBAL_RUN = Queue() # If this has content, we cant close the sim yet.
+
+from threading import Event, Lock
+
+class Quiescence():
+    """
+    Represents the nodes still running and the frames still in flight. Done
+    is set the moment both are zero, as then nothing more can happen.
+
+    Frames are in flight from being put on a wire until the device reading
+    them is done processing them, so any frames that sends are counted
+    before it is taken off.
+    """
+
+    def __init__(self, ctx: object = None):
+        """
+        :arg ctx: Multiprocessing context to share the counts across
+                  processes with, by default they are only for this one.
+        """
+
+        if (ctx is None):
+            self.lock = Lock()
+            self.counts = [0, 0]
+            self.done = Event()
+        else:
+            self.lock = ctx.Lock()
+            self.counts = ctx.Array("q", 2, lock=False)
+            self.done = ctx.Event()
+
+    def __repr__(self) -> str:
+        return f"{self.counts[0]} RUNNING, {self.counts[1]} IN FLIGHT"
+
+    def _add(self, i: int, n: int) -> int:
+        with self.lock:
+            self.counts[i] += n
+            if ((self.counts[0] == 0) and (self.counts[1] == 0)):
+                self.done.set()
+            return self.counts[i]
+
+    def join(self, n: int = 1) -> int:
+        """
+        Adds running nodes, giving back how many there are.
+        """
+
+        return self._add(0, n)
+
+    def leave(self) -> int:
+        """
+        Marks a node as done, giving back how many are left.
+        """
+
+        return self._add(0, -1)
+
+    def sent(self) -> None:
+        """
+        Marks a frame as put on a wire.
+        """
+
+        self._add(1, 1)
+
+    def landed(self) -> None:
+        """
+        Marks a frame as done being processed.
+        """
+
+        self._add(1, -1)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks until the sim is done.
+        """
+
+        return self.done.wait(timeout)
+
+RUN = Quiescence() # What is left to do before we can close the sim
@@ -0,0 +1,78 @@
+"""
+Used to keep track of the frames a node is waiting to get ACKs for.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+from threading import Lock
+from typing import Hashable, List, Tuple
+from engine import now
+from frame import Frame
+
+class Tracker():
+    """
+    Represents the frames waiting on ACKs, kept in a heap by when they are
+    next due to be resent and indexed by what an ACK for them looks like.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.heap = list() # (deadline, id), stale entries are skipped
+        self.frames = dict() # id -> [deadline, key, frame, first sent]
+        self.index = dict() # key -> ids
+        self.order = count()
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def add(self, key: Hashable, f: Frame) -> None:
+        """
+        Starts tracking a frame, due to be resent a timeout from now.
+        """
+
+        with self.lock:
+            i = next(self.order)
+            t = now() + self.timeout
+            self.frames[i] = [t, key, f, now()]
+            self.index.setdefault(key, set()).add(i)
+            heappush(self.heap, (t, i))
+
+    def find(self, key: Hashable) -> List[Frame]:
+        """
+        Gets every frame tracked under a key.
+        """
+
+        with self.lock:
+            return [self.frames[i][2] for i in self.index.get(key, ())]
+
+    def drop(self, key: Hashable) -> List[Tuple[Frame, float]]:
+        """
+        Stops tracking every frame under a key, giving them back with when
+        they were first sent.
+        """
+
+        # Their heap entries are left to be skipped once they come up
+
+        with self.lock:
+            return [tuple(self.frames.pop(i)[2:])
+                    for i in self.index.pop(key, ())]
+
+    def due(self) -> List[Frame]:
+        """
+        Gets the frames that are due to be resent, and sets them to be due
+        again a timeout from now.
+        """
+
+        ret = list()
+        with self.lock:
+            t = now()
+            while (self.heap and (self.heap[0][0] < t)):
+                (d, i) = heappop(self.heap)
+                tmp = self.frames.get(i, None)
+                if ((tmp is None) or (tmp[0] != d)):
+                    continue
+                ret.append(tmp[2])
+                tmp[0] = t + self.timeout
+                heappush(self.heap, (tmp[0], i))
+        return ret
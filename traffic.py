@@ -0,0 +1,95 @@
+"""
+Used to make the messages nodes send as they go, instead of reading them
+all out of a file for each node at the start.
+
+A pattern is called with the (net, name) of the node sending and of every
+node on the network, and gives back a generator of (time, net, node, data)
+in time order. Times are seconds from when the node starts sending. Extra
+settings are given with functools.partial, ie
+
+    partial(poisson, rate=50, count=100000)
+
+Data has to be unique for each destination, as it is used to match ACKs.
+"""
+
+from random import Random
+from re import match
+from typing import Callable, Iterator, List, Optional, Tuple
+
+Id = Tuple[int, int]
+Message = Tuple[float, int, int, str]
+Pattern = Callable[[Id, List[Id]], Iterator[Message]]
+
+def _others(src: Id, ids: List[Id]) -> List[Id]:
+    return [x for x in ids if (x != src)]
+
+def all_to_all(src: Id, ids: List[Id], count: int = 1,
+               gap: float = 0.0) -> Iterator[Message]:
+    """
+    Sends count messages to every other node in turn, gap seconds apart.
+    """
+
+    t = 0.0
+    for i in range(count):
+        for (dn, dst) in _others(src, ids):
+            yield (t, dn, dst, f"{i} from {src[0]}_{src[1]}")
+            t += gap
+
+def hotspot(src: Id, ids: List[Id], count: int = 1, gap: float = 0.0,
+            hot: Optional[Id] = None, share: float = 0.8,
+            rng: Random = None) -> Iterator[Message]:
+    """
+    Sends count messages gap seconds apart, share of them to the hot node
+    (the first node by default) and the rest to any other node.
+    """
+
+    others = _others(src, ids)
+    if (hot is None):
+        hot = ids[0]
+    if (rng is None):
+        rng = Random(f"{src}")
+    t = 0.0
+    for i in range(count):
+        if ((hot != src) and (rng.random() < share)):
+            (dn, dst) = hot
+        else:
+            (dn, dst) = rng.choice(others)
+        yield (t, dn, dst, f"{i} from {src[0]}_{src[1]}")
+        t += gap
+
+def poisson(src: Id, ids: List[Id], rate: float = 10.0, count: int = None,
+            duration: float = None, rng: Random = None) -> Iterator[Message]:
+    """
+    Sends messages to random nodes as a Poisson process of rate messages a
+    second, until count are sent or duration has passed.
+    """
+
+    others = _others(src, ids)
+    if (rng is None):
+        rng = Random(f"{src}")
+    t = 0.0
+    i = 0
+    while (((count is None) or (i < count))
+           and ((duration is None) or (t < duration))):
+        t += rng.expovariate(rate)
+        (dn, dst) = rng.choice(others)
+        yield (t, dn, dst, f"{i} from {src[0]}_{src[1]}")
+        i += 1
+
+def replay(src: Id, ids: List[Id], path: str) -> Iterator[Message]:
+    """
+    Sends the messages a trace file has for the node. Each line of the file
+    is TIME NET_NODE>NET_NODE: DATA, from sender to reciver.
+    """
+
+    with open(path) as f:
+        for l in f:
+            if (not l.strip()):
+                continue
+            m = match(r'(\S+) (\d+)_(\d+)>(\d+)_(\d+): (.*)', l)
+            if (m is None):
+                raise Exception("Malformed traffic file!")
+            if ((int(m[2]), int(m[3])) == src):
+                yield (float(m[1]), int(m[4]), int(m[5]), m[6])
+
+PATTERNS = {"all": all_to_all, "hotspot": hotspot, "poisson": poisson}
@@ -3,15 +3,28 @@ Used to represent the hardware wires that would exist in real life betwene
 swithches. IPC is used to send messages like a wire to each device thread.
 """
 
+from collections import deque
 from dataclasses import dataclass, field
-from queue import Queue
-from frame import Frame, load_frame, dump_frame
-from typing import Tuple
-from time import sleep
-
-# Delay to prevent IPC thrashing
-
-MSG_WAIT = 0.000000000000000000001
+from heapq import heappush, heappop
+from itertools import count
+from threading import Condition
+from time import time
+from frame import Frame, view_frame, dump_frame
+from typing import Tuple, Optional
+import engine
+import metrics
+import tops
+
+HEARTBEAT = 0.5 # How long (sec) a device goes between running its timers
+TAP = None # Gets every frame put on a wire, ie a capture.Capture
+
+# What a wire is like unless told otherwise when connected
+
+BANDWIDTH = None # Bytes a second a wire carries, None for no limit
+LATENCY = None # Time (sec) a frame spends on a wire, None for the default
+CAPACITY = None # Most frames a wire holds before it is full, None for any
+POLICY = "drop" # What a full wire does: drop new frames or block the sender
+BLOCK_TIME = 1.0 # Most time (sec) a sender is blocked before the frame drops
 
 @dataclass
 class Wire():
@@ -21,7 +34,94 @@ class Wire():
 
     write: object
     read: object
-    q: Queue = field(default_factory=Queue)
+    label: str = field(init=False, repr=False, compare=False)
+    blocked: bool = field(default=False, repr=False, compare=False) # Off tree
+    bandwidth: float = field(default=None, repr=False, compare=False)
+    latency: float = field(default=None, repr=False, compare=False)
+    capacity: int = field(default=None, repr=False, compare=False)
+    policy: str = field(default="drop", repr=False, compare=False)
+
+    def __post_init__(self):
+        self.label = f"{self.write.label}>{self.read.label}"
+        if (self.policy not in ("drop", "block")):
+            raise Exception(f"Unknown wire policy {self.policy}!")
+
+        # Frames on the wire and not yet read, and when the last one will be
+        # done being sent
+
+        self.queued = 0
+        self.busy = 0.0
+        self.cv = Condition()
+
+    def modeled(self) -> bool:
+        """
+        Checks if the wire takes time to cross.
+        """
+
+        return (self.bandwidth is not None) or (self.latency is not None)
+
+class Inbox():
+    """
+    Represents the frames waiting on a device, tagged with the wire they
+    arrived on.
+    """
+
+    def __init__(self):
+        self.q = deque()
+        self.later = list() # (time due, order, wire, frame) still crossing
+        self.order = count()
+        self.cv = Condition()
+        self.reading = False # Someone has started taking frames off
+
+    def __len__(self) -> int:
+        return len(self.q) + len(self.later)
+
+    def put(self, link: Wire, msg: bytes, at: float = None) -> None:
+        """
+        Adds a frame and wakes the reader.
+
+        :arg at: When the frame is done crossing its wire, by default now.
+        """
+
+        with self.cv:
+            if (at is None):
+                self.q.append((link, msg))
+            else:
+                heappush(self.later, (at, next(self.order), link, msg))
+            self.cv.notify()
+
+    def get(self, timeout: float) -> Optional[Tuple[Wire, bytes]]:
+        """
+        Waits up to timeout seconds for a frame, or until the sim is done.
+        """
+
+        end = time() + timeout
+        self.reading = True
+        with self.cv:
+            while (1):
+
+                # Frames done crossing their wire can be read
+
+                while (self.later and (self.later[0][0] <= time())):
+                    (_, _, link, msg) = heappop(self.later)
+                    self.q.append((link, msg))
+                if (self.q):
+                    return self.q.popleft()
+
+                wait = end - time()
+                if ((wait <= 0) or tops.RUN.done.is_set()):
+                    return None
+                if (self.later):
+                    wait = min(wait, self.later[0][0] - time())
+                self.cv.wait(max(wait, 0))
+
+    def wake(self) -> None:
+        """
+        Wakes the reader without a frame, ie to see that the sim is done.
+        """
+
+        with self.cv:
+            self.cv.notify_all()
 
 
 # Collection of difrent wires that are being used in difrent ways.
@@ -30,24 +130,76 @@ LINKS = dict()
 READ_LINKS = dict()
 WRITE_LINKS = dict()
 LINK_PAIRS = dict()
-
-def connect(a: object, b: object):
+INBOXES = dict()
+
+SENT = metrics.counter("wire_frames_sent", "Frames put on each wire.",
+                       ["wire"])
+SENT_BYTES = metrics.counter("wire_bytes_sent", "Bytes put on each wire.",
+                             ["wire"])
+DEPTH = metrics.gauge("wire_queue_depth",
+                      "Frames on each wire waiting to be read.", ["wire"])
+DROPPED = metrics.counter("wire_frames_dropped",
+                          "Frames dropped as their wire was full.", ["wire"])
+
+def connect(a: object, b: object, **kw):
     """
     Connects two devices with two simplex links.
+
+    :arg kw: What the wires are like (bandwidth, latency, capacity and
+             policy), by default BANDWIDTH, LATENCY, CAPACITY and POLICY.
     """
 
-    tmp = Wire(a, b)
+    for x in (a, b):
+        if (x not in INBOXES):
+            INBOXES[x] = Inbox()
+
+    kw = {"bandwidth": BANDWIDTH, "latency": LATENCY, "capacity": CAPACITY,
+          "policy": POLICY, **kw}
+    tmp = Wire(a, b, **kw)
     LINKS[(a,b)] = tmp
     READ_LINKS[b] = [*READ_LINKS.get(b, list()), tmp]
     WRITE_LINKS[a] = [*WRITE_LINKS.get(a, list()), tmp]
     LINK_PAIRS[(a, b.net, b.name)] = tmp
-    tmp2 = Wire(b, a)
+    tmp2 = Wire(b, a, **kw)
     LINKS[(b,a)] = tmp2
     WRITE_LINKS[b] = [*WRITE_LINKS.get(b, list()), tmp2]
     READ_LINKS[a] = [*READ_LINKS.get(a, list()), tmp2]
     LINK_PAIRS[(b, a.net, a.name)] = tmp2
     
 
+def rewire(old: object, new: object) -> None:
+    """
+    Moves every wire of a device onto another, as if unplugged from one and
+    plugged into the other. The wires are kept, so anything holding one
+    (like an ST) now reaches the new device.
+    """
+
+    if (new not in INBOXES):
+        INBOXES[new] = Inbox()
+
+    for ((a, b), link) in list(LINKS.items()):
+        if ((a is not old) and (b is not old)):
+            continue
+        del LINKS[(a, b)]
+        if (link.write is old):
+            link.write = new
+        if (link.read is old):
+            link.read = new
+        link.label = f"{link.write.label}>{link.read.label}"
+        LINKS[(link.write, link.read)] = link
+    READ_LINKS[new] = READ_LINKS.pop(old, list())
+    WRITE_LINKS[new] = WRITE_LINKS.pop(old, list())
+
+    # Pairs are looked up by the device and the net and name at the other end
+
+    for ((d, net, name), link) in list(LINK_PAIRS.items()):
+        if (d is old):
+            del LINK_PAIRS[(d, net, name)]
+            LINK_PAIRS[(new, net, name)] = link
+        elif ((net == old.net) and (name == old.name)):
+            del LINK_PAIRS[(d, net, name)]
+            LINK_PAIRS[(d, new.net, new.name)] = link
+
 def send(src: object, f: Frame, dst: object):
     """
     Sends a frame to a destination if it has permission.
@@ -62,33 +214,78 @@ def send(src: object, f: Frame, dst: object):
     # Send message as binary stream over ipc 
 
     msg = dump_frame(f, force_crc=f.crc, do_crc=False)
-    tmp.q.put(msg)
+    deliver(tmp, msg)
 
-def receive(d: object) -> Tuple[Wire, Frame]:
+def deliver(link: Wire, msg: bytes):
     """
-    Reads a frame off of all connected wires.
+    Puts an encoded frame on a wire, or hands it to the engine or event loop
+    driving the sim.
     """
-    while (1):
 
-        # search throuh all conected wires
+    # Make room on the wire, the engine and event loop cant wait on a full
+    # one so they always drop. Nor can a sender before the device reading
+    # the wire is running, as nothing would ever make room.
+
+    with link.cv:
+        if ((link.capacity is not None) and (link.queued >= link.capacity)
+            and (link.policy == "block") and (engine.ENGINE is None)
+            and INBOXES[link.read].reading):
+            link.cv.wait_for(lambda: link.queued < link.capacity, BLOCK_TIME)
+        if ((link.capacity is not None) and (link.queued >= link.capacity)):
+            DROPPED.inc(link.label)
+            return
+        link.queued += 1
+
+        # Frames wait for the ones before them to be sent, then take their
+        # size over the bandwidth to send and the latency to cross
+
+        delay = None
+        if (link.modeled()):
+            t = engine.now()
+            link.busy = max(link.busy, t)
+            if (link.bandwidth is not None):
+                link.busy += len(msg) / link.bandwidth
+            delay = link.busy - t + (link.latency or 0.0)
+
+    if (TAP is not None):
+        TAP.record(link, msg)
+    SENT.inc(link.label)
+    SENT_BYTES.inc(link.label, n=len(msg))
+    DEPTH.inc(link.label)
+    if (engine.ENGINE is not None):
+        engine.ENGINE.deliver(link, msg, delay)
+    else:
+        tops.RUN.sent()
+        INBOXES[link.read].put(link, msg,
+                               None if (delay is None) else time() + delay)
+
+def taken(link: Wire) -> None:
+    """
+    Marks a frame as read off of a wire.
+    """
 
-        for link in READ_LINKS[d]:
-            if (link.q.empty()):
+    DEPTH.dec(link.label)
+    with link.cv:
+        link.queued -= 1
+        link.cv.notify()
 
-                # If a wire with a message is not found move on
+def receive(d: object, timeout: float = HEARTBEAT) -> Tuple[Wire, Frame]:
+    """
+    Reads a frame off of all connected wires.
+    """
 
-                sleep(MSG_WAIT)
-                continue
-            else:
+    # Sleep on the inbox until a frame arrives
 
-                # Return mesage found on wire
-                tmp = load_frame(link.q.get())
-                return (link, tmp)
+    tmp = INBOXES[d].get(timeout)
 
-        # Just incase it is quiet, run a processing thread with empty values to
-        # make sure any wating messages are sent.
+    # Just incase it is quiet, run a processing thread with empty values to
+    # make sure any wating messages are sent.
 
+    if (tmp is None):
         return (None, None)
+    (link, msg) = tmp
+    taken(link)
+    return (link, view_frame(msg))
 
 def brodcast(d: object, f: Frame, block:Wire=None, crc=None):
     """
@@ -104,6 +301,8 @@ def brodcast(d: object, f: Frame, block:Wire=None, crc=None):
     # search through conected links
 
     for link in WRITE_LINKS[d]:
+        if (link.blocked):
+            continue
         if (block is not None):
 
             # Dont send to the port we just recieved the message on
@@ -113,4 +312,4 @@ def brodcast(d: object, f: Frame, block:Wire=None, crc=None):
 
         # Send the message as a binary stream on ipc
 
-        link.q.put(msg)
+        deliver(link, msg)
@@ -0,0 +1,137 @@
+"""
+Used to write out what nodes record without opening a file for every line.
+"""
+
+import atexit
+from collections import defaultdict
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import time
+
+FLUSH_SIZE = 256 # How many lines to write before flushing the files
+FLUSH_TIME = 0.5 # Most time (sec) a line waits before being flushed
+
+class Writer():
+    """
+    Represents a background thread appending lines to files, keeping them
+    open and flushing them in batches.
+    """
+
+    def __init__(self, flush_size: int = FLUSH_SIZE,
+                 flush_time: float = FLUSH_TIME):
+        self.flush_size = flush_size
+        self.flush_time = flush_time
+        self.q = Queue()
+        self.files = dict()
+        self.thread = None
+        self.lock = Lock()
+
+    def write(self, path: str, line: str) -> None:
+        """
+        Queues a line to be appended to a file.
+        """
+
+        if (self.thread is None):
+            with self.lock:
+                if (self.thread is None):
+                    self.thread = Thread(target=self.work, name="[WRITER]",
+                                         daemon=True)
+                    self.thread.start()
+        self.q.put((path, line))
+
+    def _flush(self) -> None:
+        for x in self.files.values():
+            x.flush()
+
+    def work(self) -> None:
+        """
+        Writes out queued lines until closed.
+        """
+
+        pending = 0
+        last = time()
+        while (1):
+            try:
+                job = self.q.get(timeout=self.flush_time)
+            except Empty:
+                job = False
+
+            # An empty job is the signal to close up
+
+            if (job is None):
+                self._flush()
+                for x in self.files.values():
+                    x.close()
+                self.files = dict()
+                self.q.task_done()
+                return
+
+            if (job):
+                (path, line) = job
+                f = self.files.get(path, None)
+                if (f is None):
+                    f = open(path, "a")
+                    self.files[path] = f
+                f.write(line)
+                pending += 1
+                self.q.task_done()
+
+            # Flush once enough has built up or it has sat long enough
+
+            if (pending and ((pending >= self.flush_size)
+                             or ((last + self.flush_time) < time()))):
+                self._flush()
+                pending = 0
+                last = time()
+
+    def flush(self) -> None:
+        """
+        Waits for every queued line to be written.
+        """
+
+        if (self.thread is not None):
+            self.q.join()
+
+    def close(self) -> None:
+        """
+        Writes out everything queued and closes the files.
+        """
+
+        with self.lock:
+            if (self.thread is None):
+                return
+            self.q.put(None)
+            self.thread.join()
+            self.thread = None
+
+class MemorySink():
+    """
+    Represents a writer that keeps lines in memory instead of on disk.
+    """
+
+    def __init__(self):
+        self.lines = defaultdict(list)
+        self.lock = Lock()
+
+    def write(self, path: str, line: str) -> None:
+        with self.lock:
+            self.lines[path].append(line)
+
+    def flush(self) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+OUT = Writer() # Where nodes write what they record
+
+def use(w: object) -> None:
+    """
+    Makes nodes write through the given writer, closing the old one.
+    """
+
+    global OUT
+    OUT.close()
+    OUT = w
+
+atexit.register(lambda: OUT.close())